@@ -0,0 +1,304 @@
+"""
+Benchmarks the orchestration in `generate` against `ai.FakeAPI`, so model speed drops out.
+
+Usage:
+    python benchmarks/run.py [--json results.json] [--baseline old.json] [--tolerance 0.25]
+
+Each case reports seconds per run, items per second and peak traced memory.
+With --baseline, exits with status 1 when a case is slower than the baseline
+by more than the tolerance.
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from generate import ai, cache, generators, steps  # noqa: E402
+
+
+def measure(name: str, function, items: int, repeat: int = 3) -> dict:
+    """Runs `function` `repeat` times and keeps the fastest run."""
+    best = None
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - start
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        best = seconds if best is None else min(best, seconds)
+    return {
+        "name": name,
+        "seconds": best,
+        "items_per_second": items / best if best else 0.0,
+        "peak_bytes": peak,
+    }
+
+
+def startup(code: str):
+    """
+    Runs `code` in a fresh interpreter, failing if it loaded a backend or NLTK,
+    which only running a generator should do.
+    """
+    code += (
+        "\nimport sys"
+        "\nheavy = [name for name in ('gpt4all', 'nltk') if name in sys.modules]"
+        "\nassert not heavy, f'Loaded at startup: {heavy}'"
+    )
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [ROOT, environment.get("PYTHONPATH")])
+    )
+
+    def run():
+        process = subprocess.run(
+            [sys.executable, "-c", code],
+            env=environment,
+            capture_output=True,
+            text=True,
+        )
+        if process.returncode:
+            raise RuntimeError(process.stderr)
+
+    return run
+
+
+def interpret(generator_class, workers: int = 1, latency: float = 0.0):
+    def run():
+        generator = generator_class("How do I sort a list?", "BENCH", "fake", workers)
+        generator.cli.latency = latency
+        generator.interpret()
+        generator.close()
+
+    return run
+
+
+def product_expansion(width: int):
+    api = ai.FakeAPI(response_size=200)
+    blurb_list = [
+        "context",
+        [f"a{idx}" for idx in range(width)],
+        [f"b{idx}" for idx in range(width)],
+    ]
+    return lambda: api.process(blurb_list, max_combinations=width * width)
+
+
+def cache_round_trip(entries: int):
+    def run():
+        store = cache.ResponseStore(f"bench-{time.perf_counter_ns()}.db")
+        keys = [cache.request_key(f"message {idx}", "template") for idx in range(entries)]
+        for key in keys:
+            store.put(key, "response " * 100)
+        for key in keys:
+            store.get(key)
+        store.close()
+
+    return run
+
+
+def file_inputs(count: int, size: int):
+    """Formats a FileStep over a directory; runs after the first hit the file cache."""
+    os.makedirs("corpus", exist_ok=True)
+    for idx in range(count):
+        with open(os.path.join("corpus", f"{idx}.md"), "w", encoding="utf8") as file:
+            file.write(ai.FakeAPI(response_size=size).synthesize(f"document {idx}"))
+    step = steps.FileStep("Corpus", ["corpus", "Summarize the document above."])
+    return lambda: step.format_inputs(step.inputs, {})
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    A local OpenAI-compatible chat completions server answering with
+    `ai.FakeAPI`, so the HTTP backend is measured without a network or model.
+    The first `failures` requests get a 503, to exercise the retries.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.0, failures: int = 0):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.fake = ai.FakeAPI(response_size=500)
+        self.latency = latency
+        self.failures = failures
+        self.connections = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status: int, body: bytes, content_type: str = "application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.lock:
+            self.server.requests += 1
+            failing = self.server.failures > 0
+            self.server.failures -= failing
+        if failing:
+            self.reply(503, b"{}")
+            return
+        time.sleep(self.server.latency)
+        messages = request["messages"]
+        system = messages[0]["content"] if messages[0]["role"] == "system" else ""
+        content = self.server.fake.synthesize(messages[-1]["content"], system)
+        if not request.get("stream"):
+            choice = {"message": {"role": "assistant", "content": content}}
+            self.reply(200, json.dumps({"choices": [choice]}).encode("utf8"))
+            return
+        events = [
+            {"choices": [{"delta": {"content": content[start : start + 16]}}]}
+            for start in range(0, len(content), 16)
+        ]
+        body = "".join(f"data: {json.dumps(event)}\n\n" for event in events)
+        self.reply(200, (body + "data: [DONE]\n\n").encode("utf8"), "text/event-stream")
+
+
+def http_backend(prompts: int, latency: float, concurrency: int):
+    """Answers `prompts` prompts through a stand-in server, 2 of them after a 503."""
+    from generate.httpapi import HTTPAPI
+
+    def run():
+        server = StandInServer(latency, failures=2)
+        api = HTTPAPI(caching=False, base_url=server.url, concurrency=concurrency)
+        api.backoff = 0.0
+        responses = api.process(["context", [f"q{idx}" for idx in range(prompts)]])
+        api.close()
+        server.shutdown()
+        server.server_close()
+        assert all(responses) and api.retried == 2
+        # Keep-alive: no more connections than requests in flight, plus the retried ones.
+        assert server.connections <= concurrency + 2, server.connections
+
+    return run
+
+
+def parsing(step: steps.Step, responses: list[str]):
+    return lambda: step.processing(responses)
+
+
+def cases() -> list[dict]:
+    responses = [
+        ai.FakeAPI(response_size=20000).synthesize(f"response {idx}")
+        for idx in range(20)
+    ]
+    rules_splitter = steps.SentenceStep()
+    rules_splitter.splitter = "rules"
+    return [
+        measure("startup: import organizer", startup("import generate.organizer"), 1),
+        measure(
+            "startup: tasks command",
+            startup(
+                "from generate.organizer import Organizer\nOrganizer().onecmd('tasks')"
+            ),
+            1,
+        ),
+        measure("interpret BasicGenerator", interpret(generators.BasicGenerator), 1),
+        measure("interpret CodeGenerator", interpret(generators.CodeGenerator), 17),
+        measure(
+            "interpret CodeGenerator, 10ms latency, 1 worker",
+            interpret(generators.CodeGenerator, 1, 0.01),
+            17,
+            repeat=1,
+        ),
+        measure(
+            "interpret CodeGenerator, 10ms latency, 4 workers",
+            interpret(generators.CodeGenerator, 4, 0.01),
+            17,
+            repeat=1,
+        ),
+        measure("API.process 40x40 product", product_expansion(40), 1600),
+        measure("ResponseStore put+get", cache_round_trip(2000), 4000),
+        measure(
+            "HTTPAPI.process, 10ms server latency, 8 in flight",
+            http_backend(64, 0.01, 8),
+            64,
+        ),
+        measure("FileStep directory input", file_inputs(50, 200_000), 50),
+        measure("ListStep parsing", parsing(steps.ListStep(), responses), 20),
+        measure("CodeStep parsing", parsing(steps.CodeStep(), responses), 20),
+        measure("SentenceStep parsing", parsing(steps.SentenceStep(), responses), 20),
+        measure(
+            "SentenceStep parsing, rules splitter",
+            parsing(rules_splitter, responses),
+            20,
+        ),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--json", help="Write the results to this file.")
+    parser.add_argument("--baseline", help="Compare against results from --json.")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+    # Keep the file log, whose cost is part of the orchestration, but quiet the console.
+    for handler in ai.API.logger.handlers:
+        if type(handler) is logging.StreamHandler:
+            handler.setLevel(logging.CRITICAL)
+
+    # The stores write into the working directory.
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            results = cases()
+        finally:
+            os.chdir(cwd)
+
+    for result in results:
+        print(
+            f"{result['name']:<50} {result['seconds'] * 1000:>10.2f} ms"
+            f" {result['items_per_second']:>12.1f} items/s"
+            f" {result['peak_bytes'] / 1024:>10.1f} KiB peak"
+        )
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf8") as file:
+            baseline = {result["name"]: result for result in json.load(file)}
+        slower = [
+            result["name"]
+            for result in results
+            if result["name"] in baseline
+            and result["seconds"]
+            > baseline[result["name"]]["seconds"] * (1 + args.tolerance)
+        ]
+        for name in slower:
+            print(f"Regression: {name}")
+        sys.exit(1 if slower else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,53 @@
+import argparse
+import sys
 from .organizer import Organizer
 
 
-def main():
-    Organizer().cmdloop()
+def main(argv: list[str] | None = None) -> int:
+    """
+    Opens the Prompt Organizer shell, or with `batch`, imports and runs tasks
+    without it. Returns the exit status: 0 when every task completed, 1 when
+    some failed, 2 when the file couldn't be imported and 130 on Ctrl-C.
+    """
+    parser = argparse.ArgumentParser(
+        prog="generate", description="Recursive prompting for GPT4All."
+    )
+    commands = parser.add_subparsers(dest="command")
+    batch = commands.add_parser(
+        "batch",
+        help="Run the queued tasks to completion without the shell.",
+        description="Adds the tasks of a JSON lines file, if given, in one transaction, then runs every queued task. Several batches can run at once; they lease tasks from the same queue.",
+    )
+    batch.add_argument(
+        "file",
+        nargs="?",
+        help='One task per line, e.g. {"prompt": "How do I make coffee?", "enum": "CODE"}, with the create_prompt option names as keys.',
+    )
+    batch.add_argument(
+        "--import-only",
+        action="store_true",
+        help="Queue the file's tasks without running them.",
+    )
+    args = parser.parse_args(argv)
+    organizer = Organizer()
+    if args.command is None:
+        organizer.cmdloop()
+        return 0
+    if args.file:
+        try:
+            organizer.import_tasks(args.file)
+        except (OSError, ValueError) as error:
+            organizer.logger.error("Nothing imported: %s", error)
+            return 2
+    if args.import_only:
+        return 0
+    try:
+        _, failed = organizer.run_batch()
+    except KeyboardInterrupt:
+        organizer.logger.warning("\nBatch stopped.")
+        return 130
+    return 1 if failed else 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -1,51 +1,153 @@
-from gpt4all import GPT4All
+import asyncio
+import functools
 import itertools
+import threading
+import time
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Iterator, TextIO
 from generate import utils
+from generate.cache import ResponseStore, request_key
+from generate.metrics import StepMetrics
+
+if TYPE_CHECKING:
+    from gpt4all import GPT4All
+    from generate.semantic import SemanticCache
 
 
 class API:
     logger = utils.create_logger()
+    model: str = ""
+    parameters: dict = {}
+    executor: Executor | None = None
+    max_combinations: int | None = 100
+    # Whether conversations sharing a context are generated together, so a
+    # backend keeping evaluated contexts pays for it once.
+    share_prefixes: bool = True
+    # Jobs `executor` runs at once; a shared context is split across them.
+    instances: int = 1
+    # Answers near-duplicate prompts when set; see `generate.semantic`.
+    semantic_cache: "SemanticCache | None" = None
 
-    def __init__(self, caching=True):
+    def __init__(self, caching=True, cache: ResponseStore = None):
         # Assumes windows
         self.caching = caching
         if self.caching:
-            self.previous_responses = utils.manage_dict("responses")
+            self.previous_responses = cache if cache is not None else ResponseStore()
+
+    def request_key(self, message: str, system_template: str = "") -> str:
+        return request_key(message, system_template, self.model, **self.parameters)
 
-    def process_message(self, message: str) -> str:
-        self.logger.warn(f"Message:\n{message}\n\nAnswer:\n")
+    def cached_message(self, message: str, system_template: str = "") -> str | None:
+        self.logger.debug("Message: %s", message)
         if self.caching:
-            if message in self.previous_responses:
-                self.logger.error(
-                    "Found cached response: " + self.previous_responses[message]
-                )
-                return self.previous_responses[message]
+            response = self.previous_responses.get(
+                self.request_key(message, system_template)
+            )
+            if response is not None:
+                self.logger.debug("Found cached response: %s", response)
+                return response
+        return None
+
+    def generate(self, message: str, system_template: str = "") -> str:
+        """Produces a response without touching the cache. Override per backend."""
         return ""
 
-    def cache_message(self, message: str, response: str):
-        self.logger.info(f"Cached: {response}")
+    def count_tokens(self, text: str) -> int:
+        """Estimates the tokens in `text` at four characters each. Backends with a tokenizer override this."""
+        return (len(text) + 3) // 4
+
+    def stream(self, message: str, system_template: str = "") -> Iterator[str]:
+        """Yields a response token by token. Backends without streaming yield it whole."""
+        yield self.generate(message, system_template)
+
+    def generate_streaming(
+        self, message: str, system_template: str = "", on_token=None
+    ) -> str:
+        """Calls `on_token(token)` as each token arrives and returns the joined response."""
+        tokens = []
+        for token in self.stream(message, system_template):
+            tokens.append(token)
+            if on_token:
+                on_token(token)
+        return "".join(tokens)
+
+    def process_message(self, message: str, system_template: str = "") -> str:
+        response = self.cached_message(message, system_template)
+        if response is None:
+            response = self.generate(message, system_template)
+            if response:
+                self.cache_message(message, response, system_template)
+        return response
+
+    def cache_message(self, message: str, response: str, system_template: str = ""):
+        self.logger.info("Cached: %s", response)
         if self.caching:
-            self.previous_responses[message] = response
-            utils.manage_dict("responses", self.previous_responses)
+            self.previous_responses.put(
+                self.request_key(message, system_template), response
+            )
 
-    def process_conversation(self, conversation: list[str], system_template: str = ""):
+    @staticmethod
+    def split_conversation(conversation: list[str] | tuple[str]) -> tuple[str, str]:
+        """Splits a conversation's prompt into the context it shares with its siblings and the final question."""
         # This format works well enough.
-        response = (
+        return (
             "Context:\n"
             + "\n".join(conversation[:-1])
-            + "\n\nAnswer the following:\n"
-            + conversation[-1]
+            + "\n\nAnswer the following:\n",
+            conversation[-1],
         )
-        return self.process_message(response, system_template)
 
-    def process(self, blurb_list, system_template: str = "") -> list[str]:
+    @staticmethod
+    def format_conversation(conversation: list[str] | tuple[str]) -> str:
+        return "".join(API.split_conversation(conversation))
+
+    def generate_shared(
+        self,
+        prefix: str,
+        suffixes: list[str],
+        system_template: str = "",
+        on_tokens: list = None,
+    ) -> list[str]:
+        """
+        Answers `prefix + suffix` for every suffix.
+        Backends able to keep an evaluated prefix override this to pay for it once.
+        """
+        if on_tokens:
+            return [
+                self.generate_streaming(prefix + suffix, system_template, on_token)
+                for suffix, on_token in zip(suffixes, on_tokens)
+            ]
+        return [self.generate(prefix + suffix, system_template) for suffix in suffixes]
+
+    def process_conversation(self, conversation: list[str], system_template: str = ""):
+        return self.process_message(
+            self.format_conversation(conversation), system_template
+        )
+
+    def process(
+        self,
+        blurb_list,
+        system_template: str = "",
+        on_token=None,
+        max_combinations: int = None,
+        metrics: StepMetrics = None,
+    ) -> list[str]:
         """
         [] -> [[]] -> 0 items
         [['1']] -> [['1']] -> 1 item
         ['1', ['1', '2']] -> [['1', '1'], ['1', '2']] -> 2 items
         [['1'. '3'], ['1', '2']] -> [['1', '1'], ['1', '2'], ['3', '1'], ['3', '2']] -> 4 items
+
+        Combinations are expanded lazily and cut off after `max_combinations`
+        (default `self.max_combinations`). Identical prompts are generated once.
+        Streams generated tokens when given `on_token(idx, token)`, where idx is
+        the unique prompt's position, then calls `on_token(idx, None)` once that
+        prompt's response is complete. Cached responses are sent whole, as
+        `on_token(idx, response, cached=True)`, before the generated ones.
+        Cache hits, token counts and generation time are added to `metrics`, when given.
         """
-        self.logger.debug("Blurb_list: " + str(blurb_list))
+        self.logger.debug("Inputs: %s", utils.Outline(blurb_list))
 
         def flatten_to_list_of_strings(to_flatten: list):
             def should_flatten(questionable_list):
@@ -77,48 +179,743 @@ class API:
 
         converted_lists = flatten_to_list_of_strings(blurb_list)
         self.logger.debug(
-            "converted_lists (list[item] to list[list[str]]): " + str(converted_lists)
+            "Alternatives per input: %s", [len(items) for items in converted_lists]
         )
-        product_result = list(itertools.product(*converted_lists))
-        self.logger.debug("product_result: " + str(product_result))
-        to_return = []
-        for blurb in product_result:
+        if max_combinations is None:
+            max_combinations = self.max_combinations
+        product_result = itertools.product(*converted_lists)
+        if max_combinations is not None:
+            product_result = itertools.islice(product_result, max_combinations + 1)
+        messages = []
+        prefixes: list[str | None] = []
+        suffixes = []
+        # Each combination's position in `messages`; duplicates share one.
+        positions = []
+        seen: dict[str, int] = {}
+        for count, blurb in enumerate(product_result):
+            if max_combinations is not None and count == max_combinations:
+                self.logger.warning(
+                    "Truncated the inputs to the first %s combinations.",
+                    max_combinations,
+                )
+                break
             if len(blurb) == 1:
-                to_return.append(self.process_message(blurb[0], system_template))
+                prefix, suffix = None, blurb[0]
             elif len(blurb) > 1:
-                to_return.append(self.process_conversation(blurb, system_template))
-        return to_return
+                prefix, suffix = self.split_conversation(blurb)
+            else:
+                continue
+            message = suffix if prefix is None else prefix + suffix
+            if message not in seen:
+                seen[message] = len(messages)
+                messages.append(message)
+                prefixes.append(prefix)
+                suffixes.append(suffix)
+            positions.append(seen[message])
+        del seen
+        self.logger.debug(
+            "Combinations: %s, unique prompts: %s", len(positions), len(messages)
+        )
+        # Only the combinations missing from the cache are sent out for generation.
+        to_return = [
+            self.cached_message(message, system_template) for message in messages
+        ]
+        missing = [idx for idx, response in enumerate(to_return) if response is None]
+        # Misses are embedded once, for the lookup and, once generated, for the index.
+        # Only the question is embedded; a conversation's context goes into its scope.
+        embeddings = {}
+        if self.caching and self.semantic_cache is not None and missing:
+            scopes = {
+                idx: self.request_key(prefixes[idx] or "", system_template)
+                for idx in missing
+            }
+            start = time.perf_counter()
+            matched, vectors = self.semantic_cache.lookup(
+                [suffixes[idx] for idx in missing], [scopes[idx] for idx in missing]
+            )
+            still_missing = []
+            for idx, response, vector in zip(missing, matched, vectors):
+                if response is None:
+                    still_missing.append(idx)
+                    embeddings[idx] = vector
+                else:
+                    to_return[idx] = response
+            if metrics:
+                metrics.record_semantic(
+                    len(missing) - len(still_missing), time.perf_counter() - start
+                )
+            missing = still_missing
+        if metrics:
+            metrics.record_cache(len(messages) - len(missing), len(missing))
+        if on_token:
+            generating = set(missing)
+            for idx, response in enumerate(to_return):
+                if idx not in generating:
+                    on_token(idx, response, cached=True)
+                    on_token(idx, None)
+        # Conversations sharing a context are split into one job per instance,
+        # so each instance evaluates the context once and they all run at once.
+        jobs: dict[tuple[str, int] | int, tuple[str | None, list[int]]] = {}
+        groups: dict[str, list[int]] = {}
+        for idx in missing:
+            if prefixes[idx] is None or not self.share_prefixes:
+                jobs[idx] = (None, [idx])
+            else:
+                groups.setdefault(prefixes[idx], []).append(idx)
+        instances = self.instances if self.executor is not None else 1
+        for prefix, idxs in groups.items():
+            parts = min(instances, len(idxs))
+            for part in range(parts):
+                jobs[(prefix, part)] = (
+                    prefix,
+                    idxs[part * len(idxs) // parts : (part + 1) * len(idxs) // parts],
+                )
+        arguments = (messages, suffixes, system_template, on_token)
+        start = time.perf_counter()
+        if self.executor is not None and len(jobs) > 1:
+            futures = [self.submit(job, *arguments) for job in jobs.values()]
+            generated = (future.result() for future in futures)
+        else:
+            generated = (self.run_job(job, *arguments) for job in jobs.values())
+        for (_, idxs), responses in zip(jobs.values(), generated):
+            for idx, response in zip(idxs, responses):
+                if response:
+                    self.cache_message(messages[idx], response, system_template)
+                to_return[idx] = response
+        if embeddings:
+            indexed = [idx for idx in embeddings if to_return[idx]]
+            self.semantic_cache.add(
+                [embeddings[idx] for idx in indexed],
+                [self.request_key(messages[idx], system_template) for idx in indexed],
+                [scopes[idx] for idx in indexed],
+            )
+        if metrics and missing:
+            metrics.record_generation(
+                time.perf_counter() - start,
+                sum(
+                    self.count_tokens(system_template + messages[idx])
+                    for idx in missing
+                ),
+                sum(self.count_tokens(to_return[idx] or "") for idx in missing),
+            )
+        return [to_return[idx] for idx in positions]
 
+    def run_job(
+        self,
+        job: tuple[str | None, list[int]],
+        messages: list[str],
+        suffixes: list[str],
+        system_template: str = "",
+        on_token=None,
+    ) -> list[str]:
+        """Generates one job of `process`: a lone message, or conversations sharing `prefix`."""
+        responses = self.generate_job(
+            job, messages, suffixes, system_template, on_token
+        )
+        if on_token:
+            for idx in job[1]:
+                on_token(idx, None)
+        return responses
 
-class Gpt4allAPI(API):
-    def __init__(self, caching=True, use_gpu=False, reduce_threads=True):
-        super().__init__(caching)
-        self.gpt4all_instance = GPT4All(
-            "wizardlm-13b-v1.2.Q4_0", device="gpu" if use_gpu else ""
+    def generate_job(
+        self,
+        job: tuple[str | None, list[int]],
+        messages: list[str],
+        suffixes: list[str],
+        system_template: str = "",
+        on_token=None,
+    ) -> list[str]:
+        prefix, idxs = job
+        if prefix is None:
+            idx = idxs[0]
+            if on_token:
+                return [
+                    self.generate_streaming(
+                        messages[idx], system_template, functools.partial(on_token, idx)
+                    )
+                ]
+            return [self.generate(messages[idx], system_template)]
+        return self.generate_shared(
+            prefix,
+            [suffixes[idx] for idx in idxs],
+            system_template,
+            [functools.partial(on_token, idx) for idx in idxs] if on_token else None,
         )
-        print("using gpu")
+
+    def submit(self, job: tuple[str | None, list[int]], *arguments) -> Future:
+        """Schedules `run_job` on `executor`."""
+        return self.executor.submit(self.run_job, job, *arguments)
+
+    def close(self):
+        """Releases anything held for generation."""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+class FakeAPI(API):
+    """
+    A deterministic stand-in backend for benchmarks and offline runs.
+
+    Every response is built from a hash of the request, as a header, a
+    numbered list and a code block, so the list, code and sentence steps have
+    something to parse.
+
+    Arguments:
+        response_size: int - Roughly how many characters each response has.
+        latency: float - Seconds each generation waits before answering.
+        token_size: int - Characters per streamed token.
+    """
+
+    model = "fake"
+    words = (
+        "model token cache step prompt answer list code report queue worker "
+        "latency memory batch context parser sentence file index thread"
+    ).split()
+
+    def __init__(
+        self,
+        caching=False,
+        cache: ResponseStore = None,
+        response_size: int = 2000,
+        latency: float = 0.0,
+        token_size: int = 4,
+    ):
+        super().__init__(caching, cache)
+        self.response_size = response_size
+        self.latency = latency
+        self.token_size = token_size
+        self.parameters = {"response_size": response_size}
+
+    def synthesize(self, message: str, system_template: str = "") -> str:
+        seed = int(self.request_key(message, system_template)[:16], 16)
+        words = self.words
+        lines = [f"### {words[seed % len(words)].title()}", ""]
+        size = 0
+        item = 1
+        while size < self.response_size * 3 // 4:
+            seed = (seed * 6364136223846793005 + 1442695040888963407) % 2**64
+            sentence = " ".join(
+                words[(seed >> shift) % len(words)] for shift in range(0, 40, 4)
+            )
+            line = f"{item}. {sentence.capitalize()}. It is item {item}."
+            lines.append(line)
+            size += len(line) + 1
+            item += 1
+        lines += ["", "```python", f"def item_{item}():"]
+        lines += [f"    return {seed % 1000}", "```"]
+        return "\n".join(lines)
+
+    # override
+    def generate(self, message: str, system_template: str = "") -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        return self.synthesize(message, system_template)
+
+    # override
+    def stream(self, message: str, system_template: str = "") -> Iterator[str]:
+        if self.latency:
+            time.sleep(self.latency)
+        response = self.synthesize(message, system_template)
+        for start in range(0, len(response), self.token_size):
+            yield response[start : start + self.token_size]
+
+
+class AsyncAPI:
+    """
+    Awaitable access to an API, running its blocking calls in an executor.
+
+    Arguments:
+        api: API - The backend doing the work.
+        executor: Executor - Where calls run, or None for the loop's default.
+    """
+
+    def __init__(self, api: API, executor: Executor = None):
+        self.api = api
+        self.executor = executor
+
+    async def run(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(function, *args, **kwargs)
+        )
+
+    async def process_message(self, message: str, system_template: str = "") -> str:
+        return await self.run(self.api.process_message, message, system_template)
+
+    async def process_conversation(
+        self, conversation: list[str], system_template: str = ""
+    ) -> str:
+        return await self.run(
+            self.api.process_conversation, conversation, system_template
+        )
+
+    async def process(
+        self,
+        blurb_list,
+        system_template: str = "",
+        on_token=None,
+        max_combinations: int = None,
+        metrics: StepMetrics = None,
+    ) -> list[str]:
+        return await self.run(
+            self.api.process,
+            blurb_list,
+            system_template,
+            on_token,
+            max_combinations,
+            metrics,
+        )
+
+    def close(self):
+        self.api.close()
+
+
+class StreamStats:
+    """
+    Times the tokens streamed for one step and optionally echoes them.
+
+    Pass an instance as `on_token` to `API.process`. When `live`, one
+    response at a time is echoed token by token while the others are held
+    and written whole once they are complete. Otherwise, as when several
+    steps stream at once, every response is held and written whole, under
+    its step's header, so responses never interleave. Cached responses are
+    echoed like the others but left out of the timings and token count.
+
+    Arguments:
+        output: TextIO - Where responses are echoed, or None.
+        title: str - The step's title, written as a header.
+        live: bool - Whether this step is the only one writing to `output`.
+    """
+
+    # Serializes writes from every step sharing an output.
+    output_lock = threading.Lock()
+
+    def __init__(self, output: TextIO = None, title: str = "", live: bool = True):
+        self.output = output
+        self.title = title
+        self.live = live
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.first_token: float | None = None
+        self.end: float | None = None
+        self.tokens = 0
+        self.buffers: dict[int, list[str]] = {}
+        self.complete: list[int] = []
+        self.echoing: int | None = None
+        self.header_written = False
+
+    def __call__(self, idx: int, token: str | None, cached: bool = False):
+        if token is None:
+            self.finish_response(idx)
+            return
+        with self.lock:
+            if not cached:
+                if self.first_token is None:
+                    self.first_token = time.perf_counter()
+                self.tokens += 1
+            if self.output is None:
+                return
+            if self.live and self.echoing is None:
+                self.echoing = idx
+                self.write(self.buffers.pop(idx, []))
+            if self.echoing == idx:
+                self.write([token])
+            else:
+                self.buffers.setdefault(idx, []).append(token)
+
+    def finish_response(self, idx: int):
+        with self.lock:
+            if self.output is None:
+                return
+            if self.echoing == idx:
+                self.echoing = None
+                self.write(["\n\n"])
+            else:
+                self.complete.append(idx)
+            if self.echoing is None:
+                self.flush_complete()
+
+    def flush_complete(self):
+        """Writes the held responses that are complete. Assumes the lock is held."""
+        for idx in self.complete:
+            self.write(self.buffers.pop(idx, []) + ["\n\n"])
+        self.complete = []
+
+    def write(self, tokens: list[str]):
+        if not tokens:
+            return
+        with self.output_lock:
+            if not self.header_written or not self.live:
+                self.output.write(f"\n## {self.title}\n")
+                self.header_written = True
+            self.output.write("".join(tokens))
+            self.output.flush()
+
+    def finish(self) -> dict[str, float]:
+        self.end = time.perf_counter()
+        if self.output is not None:
+            with self.lock:
+                # Responses cut short by an error still get written.
+                self.complete += [idx for idx in self.buffers if idx not in self.complete]
+                self.echoing = None
+                self.flush_complete()
+        return self.summary()
+
+    def summary(self) -> dict[str, float]:
+        end = self.end or time.perf_counter()
+        first_token = self.first_token or end
+        generating = end - first_token
+        return {
+            "time_to_first_token": first_token - self.start,
+            "tokens": self.tokens,
+            "tokens_per_second": self.tokens / generating if generating > 0 else 0.0,
+            "seconds": end - self.start,
+        }
+
+
+class ModelPool:
+    """
+    Up to `size` instances of one model, loaded as concurrent callers need them.
+    One instance generates one answer at a time.
+
+    Each instance remembers the last shared prefix it evaluated, so checking one
+    out for the same prefix skips evaluating it again.
+    """
+
+    def __init__(self, model: str, device: str = "", size: int = 1):
+        self.model = model
+        self.device = device
+        self.size = size
+        self.loaded = 0
+        self.condition = threading.Condition()
+        self.idle: list["GPT4All"] = []
+        self.prefixes: dict[int, tuple[tuple[str, str], int]] = {}
+
+    @contextmanager
+    def checkout(self, prefix: tuple[str, str] = None):
+        """
+        Yields an idle instance, preferring one holding `prefix`.
+        Without a prefix the caller is assumed to reset the instance's context.
+        """
+        with self.condition:
+            while not self.idle and self.loaded >= self.size:
+                self.condition.wait()
+            if self.idle:
+                instance = next(
+                    (
+                        candidate
+                        for candidate in self.idle
+                        if self.prefixes.get(id(candidate), (None,))[0] == prefix
+                    ),
+                    self.idle[-1],
+                )
+                self.idle.remove(instance)
+            else:
+                instance = None
+                self.loaded += 1
+        if instance is None:
+            API.logger.warning("Loading %s on %s", self.model, self.device or "cpu")
+            try:
+                instance = load_model(self.model, self.device)
+            except BaseException:
+                with self.condition:
+                    self.loaded -= 1
+                    self.condition.notify()
+                raise
+        if prefix is None:
+            self.forget_prefix(instance)
+        try:
+            yield instance
+        finally:
+            with self.condition:
+                self.idle.append(instance)
+                self.condition.notify()
+
+    def held_prefix(self, instance: "GPT4All") -> tuple[tuple[str, str] | None, int]:
+        with self.condition:
+            return self.prefixes.get(id(instance), (None, 0))
+
+    def remember_prefix(self, instance: "GPT4All", key: tuple[str, str], n_past: int):
+        with self.condition:
+            self.prefixes[id(instance)] = (key, n_past)
+
+    def forget_prefix(self, instance: "GPT4All"):
+        with self.condition:
+            self.prefixes.pop(id(instance), None)
+
+    @staticmethod
+    def can_rewind(instance: "GPT4All") -> bool:
+        """Whether this gpt4all version exposes the internals `generate_shared` rewinds."""
+        model = getattr(instance, "model", None)
+        config = getattr(instance, "config", None)
+        return (
+            hasattr(model, "prompt_model")
+            and hasattr(getattr(model, "context", None), "n_past")
+            and isinstance(config, dict)
+            and "{0}" in config.get("promptTemplate", "")
+        )
+
+    def generate_shared(
+        self,
+        instance: "GPT4All",
+        prefix: str,
+        suffixes: list[str],
+        system_template: str,
+        parameters: dict,
+        on_tokens: list = None,
+    ) -> list[str]:
+        """
+        Evaluates the chat header and `prefix` once, then answers each suffix by
+        rewinding the context to the end of the prefix, as a chat session's reset does.
+        Versions of gpt4all without those internals answer each conversation in full.
+        """
+        if not self.can_rewind(instance):
+            self.forget_prefix(instance)
+            return [
+                self.generate_plain(
+                    instance,
+                    prefix + suffix,
+                    system_template,
+                    parameters,
+                    on_tokens[idx] if on_tokens else None,
+                )
+                for idx, suffix in enumerate(suffixes)
+            ]
+        parameters = dict(parameters)
+        n_predict = parameters.pop("max_tokens")
+        system_prompt = system_template or instance.config["systemPrompt"]
+        before, _, after = instance.config["promptTemplate"].partition("{0}")
+        shared = (system_prompt + "\n\n" if system_prompt else "") + before + prefix
+        model = instance.model
+        responses = []
+        for idx, suffix in enumerate(suffixes):
+            key, n_past = self.held_prefix(instance)
+            if key != (system_template, prefix):
+                model.prompt_model(
+                    shared, lambda *_: True, n_predict=0, reset_context=True, **parameters
+                )
+                n_past = model.context.n_past
+                self.remember_prefix(instance, (system_template, prefix), n_past)
+            model.context.n_past = n_past
+            tokens = []
+
+            def collect(token_id: int, response: str) -> bool:
+                tokens.append(response)
+                if on_tokens:
+                    on_tokens[idx](response)
+                return True
+
+            model.prompt_model(suffix + after, collect, n_predict=n_predict, **parameters)
+            if model.context.n_past < n_past + len(tokens):
+                # The context overflowed and was partly erased, taking the prefix with it.
+                self.forget_prefix(instance)
+            responses.append("".join(tokens))
+        return responses
+
+    @staticmethod
+    def generate_plain(
+        instance: "GPT4All",
+        message: str,
+        system_template: str,
+        parameters: dict,
+        on_token=None,
+    ) -> str:
+        with instance.chat_session(system_template):
+            if on_token is None:
+                return instance.generate(message, **parameters)
+            tokens = []
+            for token in instance.generate(message, streaming=True, **parameters):
+                tokens.append(token)
+                on_token(token)
+            return "".join(tokens)
+
+    def close(self):
+        with self.condition:
+            instances, self.idle = self.idle, []
+            self.loaded -= len(instances)
+            for instance in instances:
+                self.prefixes.pop(id(instance), None)
+        for instance in instances:
+            if hasattr(instance, "close"):
+                instance.close()
+
+
+class ModelRegistry:
+    """
+    Shares one pool of instances per (model, device) across every task in the process.
+
+    Arguments:
+        idle_timeout: float - Seconds an unused model stays loaded, or None to keep it.
+    """
+
+    def __init__(self, idle_timeout: float = 600):
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.pools: dict[tuple[str, str], ModelPool] = {}
+        self.users: dict[tuple[str, str], int] = {}
+        self.timers: dict[tuple[str, str], threading.Timer] = {}
+
+    def acquire(self, model: str, device: str = "", size: int = 1) -> ModelPool:
+        key = (model, device)
+        with self.lock:
+            if timer := self.timers.pop(key, None):
+                timer.cancel()
+            if key not in self.pools:
+                self.pools[key] = ModelPool(model, device, size)
+            pool = self.pools[key]
+            pool.size = max(pool.size, size)
+            self.users[key] = self.users.get(key, 0) + 1
+            return pool
+
+    def release(self, model: str, device: str = ""):
+        key = (model, device)
+        with self.lock:
+            self.users[key] = max(self.users.get(key, 0) - 1, 0)
+            if self.users[key] or key not in self.pools:
+                return
+            if self.idle_timeout is None:
+                return
+            timer = threading.Timer(self.idle_timeout, self.unload, (key,))
+            timer.daemon = True
+            self.timers[key] = timer
+            timer.start()
+
+    def unload(self, key: tuple[str, str]):
+        with self.lock:
+            if self.users.get(key):
+                return
+            self.timers.pop(key, None)
+            pool = self.pools.pop(key, None)
+        if pool is not None:
+            API.logger.warning("Unloading idle %s", key[0])
+            pool.close()
+
+
+registry = ModelRegistry()
+
+
+def load_model(model: str, device: str = "") -> "GPT4All":
+    """Imports gpt4all on first use, so only running a generator loads its native library."""
+    from gpt4all import GPT4All
+
+    return GPT4All(model, device=device)
+
+
+class Gpt4allAPI(API):
+    """
+    Arguments:
+        instances: int - Model instances generating at once, on threads sharing the registry's pool.
+    """
+
+    model = "wizardlm-13b-v1.2.Q4_0"
+    parameters = {
+        "max_tokens": 50000,
+        "temp": 0.9,
+        "top_k": 40,
+        "top_p": 0.9,
+        "repeat_penalty": 1.1,
+        "repeat_last_n": 64,
+        "n_batch": 9,
+    }
+
+    def __init__(
+        self,
+        caching=True,
+        use_gpu=False,
+        reduce_threads=True,
+        cache: ResponseStore = None,
+        instances: int = 1,
+    ):
+        super().__init__(caching, cache)
+        self.device = "gpu" if use_gpu else ""
+        self.instances = instances
+        self.pool = registry.acquire(self.model, self.device, instances)
+        if instances > 1:
+            self.executor = ThreadPoolExecutor(instances)
         # if reduce_threads:
         #     self.gpt4all_instance.model.set_thread_count(1)
         # else:
         #     self.gpt4all_instance.model.set_thread_count(4)
 
     # override
-    def process_message(self, message: str, system_template: str = ""):
-        if response := super().process_message(message):
-            return response
-        with self.gpt4all_instance.chat_session(system_template):
-            response = self.gpt4all_instance.generate(
-                message,
-                max_tokens=50000,
-                temp=0.9,
-                top_k=40,
-                top_p=0.9,
-                repeat_penalty=1.1,
-                repeat_last_n=64,
-                n_batch=9,
-                # streaming=True,
+    def generate(self, message: str, system_template: str = "") -> str:
+        with self.pool.checkout() as gpt4all_instance:
+            with gpt4all_instance.chat_session(system_template):
+                return gpt4all_instance.generate(message, **self.parameters)
+
+    # override
+    def stream(self, message: str, system_template: str = "") -> Iterator[str]:
+        with self.pool.checkout() as gpt4all_instance:
+            with gpt4all_instance.chat_session(system_template):
+                yield from gpt4all_instance.generate(
+                    message, streaming=True, **self.parameters
+                )
+
+    # override
+    def generate_shared(
+        self,
+        prefix: str,
+        suffixes: list[str],
+        system_template: str = "",
+        on_tokens: list = None,
+    ) -> list[str]:
+        with self.pool.checkout((system_template, prefix)) as gpt4all_instance:
+            return self.pool.generate_shared(
+                gpt4all_instance,
+                prefix,
+                suffixes,
+                system_template,
+                self.parameters,
+                on_tokens,
             )
-        super().cache_message(message, response)
-        return response
 
+    # override
+    def close(self):
+        super().close()
+        if self.pool is not None:
+            registry.release(self.model, self.device)
+            self.pool = None
+
+
+# Generator names and the functions building their backends from a worker count.
+backends: dict[str, Callable[[int | None], API]] = {}
+
+
+def register_backend(name: str):
+    """
+    Makes a backend factory selectable by `name`. It is called with the
+    task's worker count, or None for the backend's own default.
+    """
+
+    def register(factory: Callable[[int | None], API]) -> Callable[[int | None], API]:
+        backends[name] = factory
+        return factory
+
+    return register
+
+
+def create_backend(name: str, workers: int | None = None) -> API:
+    if name not in backends:
+        raise ValueError(
+            f"Unknown generator {name!r}, expected one of {sorted(backends)}"
+        )
+    return backends[name](workers)
+
+
+@register_backend("gpt4all")
+def gpt4all_backend(workers: int | None) -> API:
+    return Gpt4allAPI(instances=workers or 1)
+
+
+@register_backend("fake")
+def fake_backend(workers: int | None) -> API:
+    return FakeAPI()
+
+
+@register_backend("http")
+def http_backend(workers: int | None) -> API:
+    # Imported here so only tasks using a server set up its connection pool.
+    from generate.httpapi import HTTPAPI
 
+    return HTTPAPI(concurrency=workers)
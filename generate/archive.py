@@ -0,0 +1,139 @@
+import os
+import pickle
+import sqlite3
+import threading
+import zlib
+from datetime import datetime
+from generate import utils
+
+
+class ReportArchive:
+    """
+    Completed reports, backed by SQLite.
+
+    A small metadata table is kept apart from the zlib-compressed report
+    bodies, so listing and deleting never read a body; `get` loads one on demand.
+
+    Arguments:
+        filename: str - The database file.
+        legacy_filename: str - The pickle store migrated once on first use.
+    """
+
+    def __init__(self, filename: str = "reports.db", legacy_filename: str = "main"):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            filename, check_same_thread=False, isolation_level=None
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS reports (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, category TEXT NOT NULL, start REAL NOT NULL, end REAL NOT NULL, size INTEGER NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS bodies (id INTEGER PRIMARY KEY, data BLOB NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)"
+        )
+        self.migrate(legacy_filename)
+
+    def migrate(self, legacy_filename: str = "main"):
+        """Moves the `report` set out of the pickle store, once."""
+        with self.lock:
+            if self.connection.execute(
+                "SELECT 1 FROM meta WHERE name = 'migrated'"
+            ).fetchone():
+                return
+            legacy = utils.manage_object(
+                "report", set(), stripped_filename=legacy_filename
+            )
+            with self.connection:
+                self.connection.execute("BEGIN")
+                for report in sorted(legacy, key=lambda report: report.start):
+                    self.insert(report)
+                self.connection.execute(
+                    "INSERT INTO meta (name, value) VALUES ('migrated', ?)",
+                    (str(len(legacy)),),
+                )
+        if legacy:
+            utils.discard_object("report", stripped_filename=legacy_filename)
+
+    @staticmethod
+    def text_size(report) -> int:
+        """The bytes of a report's text, read from its Markdown file when written there."""
+        output = getattr(report, "output", None)
+        if output and not report.text and os.path.exists(output):
+            return os.path.getsize(output)
+        return sum(len(text.encode("utf8")) for text in report.text)
+
+    def insert(self, report) -> int:
+        """Assumes the lock is held."""
+        cursor = self.connection.execute(
+            "INSERT INTO reports (title, category, start, end, size) VALUES (?, ?, ?, ?, ?)",
+            (
+                report.title,
+                report.category,
+                report.start.timestamp(),
+                report.end.timestamp(),
+                self.text_size(report),
+            ),
+        )
+        report.id = cursor.lastrowid
+        self.connection.execute(
+            "INSERT INTO bodies (id, data) VALUES (?, ?)",
+            (report.id, zlib.compress(pickle.dumps(report))),
+        )
+        return report.id
+
+    def add(self, report) -> int:
+        """Stores a report and returns its id."""
+        with self.lock:
+            with self.connection:
+                self.connection.execute("BEGIN")
+                return self.insert(report)
+
+    def get(self, report_id: int):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT data FROM bodies WHERE id = ?", (report_id,)
+            ).fetchone()
+        return pickle.loads(zlib.decompress(row[0])) if row else None
+
+    def remove(self, report_id: int) -> bool:
+        with self.lock:
+            with self.connection:
+                self.connection.execute("BEGIN")
+                cursor = self.connection.execute(
+                    "DELETE FROM reports WHERE id = ?", (report_id,)
+                )
+                self.connection.execute("DELETE FROM bodies WHERE id = ?", (report_id,))
+        return cursor.rowcount > 0
+
+    def page(
+        self, offset: int = 0, limit: int = 50
+    ) -> list[tuple[int, str, str, datetime, datetime, int]]:
+        """Returns (id, title, category, start, end, size) rows, oldest first."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id, title, category, start, end, size FROM reports ORDER BY id LIMIT ? OFFSET ?",
+                (limit, offset),
+            ).fetchall()
+        return [
+            (
+                report_id,
+                title,
+                category,
+                datetime.fromtimestamp(start),
+                datetime.fromtimestamp(end),
+                size,
+            )
+            for report_id, title, category, start, end, size in rows
+        ]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM reports").fetchone()[0]
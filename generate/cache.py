@@ -0,0 +1,202 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+def request_key(message: str, system_template: str = "", model: str = "", **parameters) -> str:
+    """Hashes everything that shapes a generation into a fixed-size cache key."""
+    request = json.dumps(
+        {
+            "message": message,
+            "system_template": system_template,
+            "model": model,
+            "parameters": parameters,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(request.encode("utf8")).hexdigest()
+
+
+class ResponseStore:
+    """
+    A persistent response cache backed by SQLite.
+
+    Every response is its own row, so caching one response never rewrites the
+    others and a lookup never loads the whole cache into memory. Entries are
+    evicted least recently used first once a limit is passed. The entry and
+    byte totals are counters in the file, changed in the same immediate
+    transaction as the rows, so every store, process and worker sharing the
+    file sees and enforces the same limits.
+
+    Responses cached in the old pickle store are not carried over: it keyed
+    them on the message alone, without the template, model and parameters
+    every lookup now includes, so they could never be found again.
+
+    Arguments:
+        filename: str - The database file.
+        max_entries: int - The most responses kept, or None for no limit.
+        max_bytes: int - The most response bytes kept, or None for no limit.
+        max_age: float - Seconds a response stays valid, or None for no limit.
+    """
+
+    def __init__(
+        self,
+        filename: str = "responses.db",
+        max_entries: int = None,
+        max_bytes: int = None,
+        max_age: float = None,
+    ):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            filename, check_same_thread=False, isolation_level=None
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS entries_created ON entries (created)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+        with self.lock, self.transaction():
+            # Files written before the totals were counters get them counted once.
+            self.connection.execute(
+                "INSERT OR IGNORE INTO counters (name, value) SELECT 'entries', COUNT(*) FROM entries"
+            )
+            self.connection.execute(
+                "INSERT OR IGNORE INTO counters (name, value) SELECT 'bytes', COALESCE(SUM(size), 0) FROM entries"
+            )
+        self.set_limits(max_entries, max_bytes, max_age)
+
+    @contextmanager
+    def transaction(self):
+        """Takes the file's write lock up front, so reads and writes inside can't race other connections."""
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            yield
+
+    def set_limits(
+        self, max_entries: int = None, max_bytes: int = None, max_age: float = None
+    ):
+        """Replaces the eviction limits and evicts whatever is now past them."""
+        with self.lock, self.transaction():
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self.max_age = max_age
+            self.evict()
+
+    def count(self, name: str, amount: int = 1):
+        if amount:
+            self.connection.execute(
+                "INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+                (name, amount),
+            )
+
+    def total(self, name: str) -> int:
+        row = self.connection.execute(
+            "SELECT value FROM counters WHERE name = ?", (name,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get(self, key: str) -> str | None:
+        with self.lock, self.transaction():
+            row = self.connection.execute(
+                "SELECT response, size, created FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row and self.max_age is not None and row[2] < now - self.max_age:
+                self.delete(key, row[1])
+                row = None
+            if row is None:
+                self.count("misses")
+                return None
+            self.connection.execute(
+                "UPDATE entries SET accessed = ? WHERE key = ?", (now, key)
+            )
+            self.count("hits")
+        return row[0]
+
+    def put(self, key: str, response: str):
+        size = len(response.encode("utf8"))
+        now = time.time()
+        with self.lock, self.transaction():
+            old = self.connection.execute(
+                "SELECT size FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (key, response, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now),
+            )
+            if not old:
+                self.count("entries")
+            self.count("bytes", size - (old[0] if old else 0))
+            self.evict()
+
+    def delete(self, key: str, size: int):
+        """Assumes the lock is held inside a transaction."""
+        cursor = self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+        if cursor.rowcount:
+            self.count("entries", -cursor.rowcount)
+            self.count("bytes", -size)
+            self.count("evictions", cursor.rowcount)
+
+    def evict(self):
+        """Drops expired entries, then the least recently used past any limit. Assumes the lock is held inside a transaction."""
+        if self.max_age is not None:
+            expired = self.connection.execute(
+                "SELECT key, size FROM entries WHERE created < ?",
+                (time.time() - self.max_age,),
+            ).fetchall()
+            for key, size in expired:
+                self.delete(key, size)
+        while self.over_limit():
+            oldest = self.connection.execute(
+                "SELECT key, size FROM entries ORDER BY accessed LIMIT 64"
+            ).fetchall()
+            if not oldest:
+                break
+            for key, size in oldest:
+                self.delete(key, size)
+                if not self.over_limit():
+                    break
+
+    def over_limit(self) -> bool:
+        return (
+            self.max_entries is not None and self.total("entries") > self.max_entries
+        ) or (self.max_bytes is not None and self.total("bytes") > self.max_bytes)
+
+    def stats(self) -> dict[str, int]:
+        """Hit, miss and eviction counters over the life of the file, plus its current size."""
+        with self.lock:
+            to_return = {"hits": 0, "misses": 0, "evictions": 0, "entries": 0, "bytes": 0}
+            to_return.update(
+                self.connection.execute("SELECT name, value FROM counters").fetchall()
+            )
+        return to_return
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def __contains__(self, key: str) -> bool:
+        with self.lock:
+            return (
+                self.connection.execute(
+                    "SELECT 1 FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                is not None
+            )
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.total("entries")
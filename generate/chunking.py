@@ -0,0 +1,67 @@
+import hashlib
+import re
+from generate import sentences
+
+PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n+")
+
+
+def split_units(text: str, max_chars: int) -> list[tuple[str, str]]:
+    """
+    Splits `text` into (unit, separator) pairs no longer than `max_chars`:
+    paragraphs, then the sentences of paragraphs too long, then fixed slices
+    of sentences too long. The separator is what joined the unit to the next.
+    """
+    units = []
+    for paragraph in PARAGRAPH_BREAK.split(text.strip()):
+        if len(paragraph) <= max_chars:
+            units.append((paragraph, "\n\n"))
+            continue
+        for sentence in sentences.split_rules(paragraph):
+            if len(sentence) <= max_chars:
+                units.append((sentence, " "))
+                continue
+            for start in range(0, len(sentence), max_chars):
+                units.append((sentence[start : start + max_chars], ""))
+            units[-1] = (units[-1][0], " ")
+        if units:
+            units[-1] = (units[-1][0], "\n\n")
+    return units
+
+
+def is_anchor(unit: str, target_chars: int) -> bool:
+    """
+    Whether a chunk may end after `unit`. This depends only on the unit's
+    text, with a chance proportional to its length, so anchors fall about
+    every `target_chars` characters and survive edits elsewhere.
+    """
+    digest = hashlib.blake2b(unit.encode("utf8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % target_chars < len(unit)
+
+
+def chunk_text(text: str, max_chars: int) -> list[str]:
+    """
+    Splits `text` into chunks of at most `max_chars` characters at
+    paragraph or sentence boundaries.
+
+    Chunks end at content-defined anchors, or when the next unit would not
+    fit. Editing one section changes its own chunk, and at most the chunks
+    up to the next anchor, so the other chunks keep their cached answers.
+    """
+    if len(text) <= max_chars:
+        return [text]
+    target_chars = max(max_chars // 2, 1)
+    chunks = []
+    current: list[str] = []
+    size = 0
+    for unit, separator in split_units(text, max_chars):
+        if current and size + len(unit) > max_chars:
+            chunks.append("".join(current).strip())
+            current, size = [], 0
+        current += [unit, separator]
+        size += len(unit) + len(separator)
+        if is_anchor(unit, target_chars):
+            chunks.append("".join(current).strip())
+            current, size = [], 0
+    if current:
+        chunks.append("".join(current).strip())
+    return [chunk for chunk in chunks if chunk]
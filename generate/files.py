@@ -0,0 +1,172 @@
+import codecs
+import glob
+import io
+import itertools
+import mmap
+import os
+import re
+import stat
+import threading
+from collections import OrderedDict
+from typing import Iterator
+
+MAGIC = re.compile(r"[*?[]")
+
+
+class FileCache:
+    """
+    Decoded file contents, reused while a file's modification time and size
+    are unchanged, so tasks over the same corpus read and decode it once.
+
+    Files of at least `mmap_threshold` bytes are decoded from a memory map
+    `slice_size` bytes at a time, instead of being copied into a read buffer
+    and decoded and newline-translated whole. The least recently used
+    contents are dropped past `max_chars`.
+
+    Arguments:
+        max_chars: int - The most characters kept across all files.
+        mmap_threshold: int - The smallest file, in bytes, read through mmap.
+    """
+
+    slice_size: int = 2**20
+
+    def __init__(self, max_chars: int = 64 * 2**20, mmap_threshold: int = 2**20):
+        self.max_chars = max_chars
+        self.mmap_threshold = mmap_threshold
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[str, tuple[int, int, str]] = OrderedDict()
+        self.chars = 0
+        self.hits = 0
+        self.misses = 0
+
+    def read(self, path: str, status: os.stat_result = None) -> str | None:
+        """Returns the file's contents, or None when `path` isn't a regular file."""
+        if status is None:
+            status = stat_path(path)
+        if status is None or not stat.S_ISREG(status.st_mode):
+            return None
+        path = os.path.abspath(path)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry and entry[:2] == (status.st_mtime_ns, status.st_size):
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        contents = self.load(path, status.st_size)
+        with self.lock:
+            previous = self.entries.pop(path, None)
+            if previous:
+                self.chars -= len(previous[2])
+            if len(contents) <= self.max_chars:
+                self.entries[path] = (status.st_mtime_ns, status.st_size, contents)
+                self.chars += len(contents)
+            while self.chars > self.max_chars:
+                _, (_, _, dropped) = self.entries.popitem(last=False)
+                self.chars -= len(dropped)
+        return contents
+
+    def load(self, path: str, size: int) -> str:
+        with open(path, "rb") as file:
+            if size < self.mmap_threshold:
+                contents = file.read().decode("utf8")
+            else:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    return self.decode_slices(mapped)
+        # Match the newlines a text-mode read would give.
+        if "\r" in contents:
+            contents = contents.replace("\r\n", "\n").replace("\r", "\n")
+        return contents
+
+    def decode_slices(self, mapped: mmap.mmap) -> str:
+        """Decodes a mapped file slice by slice, translating newlines as it goes."""
+        decoder = io.IncrementalNewlineDecoder(
+            codecs.getincrementaldecoder("utf8")(), translate=True
+        )
+        parts = []
+        with memoryview(mapped) as view:
+            for start in range(0, len(view), self.slice_size):
+                parts.append(decoder.decode(view[start : start + self.slice_size]))
+        parts.append(decoder.decode(b"", final=True))
+        return "".join(parts)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.chars = 0
+
+
+file_cache = FileCache()
+
+
+def might_be_path(text: str) -> bool:
+    """Rules out prompts and earlier responses before any system call."""
+    return 0 < len(text) < 4096 and "\n" not in text
+
+
+def is_pattern(text: str) -> bool:
+    """
+    Whether `text` is a glob pattern rather than a prompt that happens to
+    hold "*", "?" or "[". The directories before the first wildcard have
+    to exist, so a pattern in the working directory is written `./*.md`.
+    """
+    match = MAGIC.search(text)
+    if not match:
+        return False
+    base = os.path.dirname(text[: match.start()])
+    return bool(base) and os.path.isdir(base)
+
+
+def stat_path(path: str) -> os.stat_result | None:
+    try:
+        return os.stat(path)
+    except (OSError, ValueError):
+        return None
+
+
+def directory_files(path: str) -> Iterator[str]:
+    with os.scandir(path) as entries:
+        names = sorted(entry.name for entry in entries if entry.is_file())
+    return (os.path.join(path, name) for name in names)
+
+
+def read_input(text: str, max_files: int = 100) -> str | Iterator[str]:
+    """
+    Replaces a file path with the file's contents, and a directory or glob
+    pattern with an iterator over up to `max_files` contents. Files are read
+    as the iterator reaches them, so a capped pattern over a large tree stops
+    early. Anything else, including a directory or pattern without a
+    readable file, is returned unchanged.
+
+    A directory lists its files in name order; a pattern's matches come in
+    the order the file system lists them.
+    """
+    if not might_be_path(text):
+        return text
+    if is_pattern(text):
+        paths = glob.iglob(text, recursive=True)
+    else:
+        status = stat_path(text)
+        if status is None:
+            return text
+        if not stat.S_ISDIR(status.st_mode):
+            content = file_cache.read(text, status)
+            return text if content is None else content
+        paths = directory_files(text)
+    contents = itertools.islice(read_files(paths), max_files)
+    first = next(contents, None)
+    if first is None:
+        return text
+    return itertools.chain([first], contents)
+
+
+def read_files(paths: Iterator[str]) -> Iterator[str]:
+    """The contents of each regular, UTF-8 file in `paths`."""
+    for path in paths:
+        try:
+            content = file_cache.read(path)
+        except UnicodeDecodeError:
+            # Binary files sitting among the documents are skipped.
+            continue
+        if content is not None:
+            yield content
@@ -1,8 +1,14 @@
 from generate import ai
 from generate import steps
+from generate.metrics import StepMetrics
 from generate.report import Report
+from generate.scheduler import StepScheduler
+from generate.writer import MarkdownWriter
 from generate import utils
 from datetime import datetime
+import asyncio
+import sys
+import time
 
 
 class Generator:
@@ -10,9 +16,35 @@ class Generator:
 
     logger = utils.create_logger()
 
-    def __init__(self, prompt: str, name: str, api_type="gpt4all"):
-        if api_type == "gpt4all":
-            self.cli = ai.Gpt4allAPI()
+    def __init__(
+        self,
+        prompt: str,
+        name: str,
+        api_type="gpt4all",
+        workers: int = 1,
+        streaming: bool = False,
+        output: str | None = None,
+        semantic_threshold: float | None = None,
+        cache_limits: dict | None = None,
+    ):
+        self.cli = ai.create_backend(api_type, workers)
+        if cache_limits and self.cli.caching:
+            self.cli.previous_responses.set_limits(**cache_limits)
+        if semantic_threshold is not None and self.cli.caching:
+            # Imported here so NumPy is only needed by tasks that ask for it.
+            from generate.semantic import SemanticCache
+
+            self.cli.semantic_cache = SemanticCache(
+                self.cli.previous_responses, semantic_threshold
+            )
+        self.acli = ai.AsyncAPI(self.cli)
+        self.workers = workers
+        self.streaming = streaming
+        self.stream_output = sys.stdout
+        self.stream_stats: dict[int, dict[str, float]] = {}
+        self.step_metrics: dict[int, dict[str, float]] = {}
+        self.writer = MarkdownWriter(output) if output else None
+        self.checkpoint = None
         self.prompt = prompt
         self.name = name
 
@@ -20,29 +52,218 @@ class Generator:
         yield None
 
     def process_step(self, step: steps.Step, variables: dict[str, str]) -> str:
-        self.logger.debug("Unformatted inputs: " + str(step.inputs))
-        self.logger.debug("Old variables: " + str(variables))
+        metrics = StepMetrics(step.title)
+        self.logger.debug("Unformatted inputs: %s", utils.Outline(step.inputs))
+        self.logger.debug("Old variables: %s", utils.Outline(variables))
         formatted = step.format_inputs(step.inputs, variables)
-        self.logger.debug("Formatted inputs: " + str(formatted))
-        results = self.cli.process(formatted, step.template)
+        self.logger.debug("Formatted inputs: %s", utils.Outline(formatted))
+        stats = self.start_stream(step)
+        results = self.cli.process(
+            formatted, step.template, stats, step.max_combinations, metrics
+        )
+        results = self.reduce(step, results, stats, metrics)
+        self.finish_stream(step, stats)
+        start = time.perf_counter()
         results = step.processing(results)
-        self.logger.debug("Processed results: " + str(results))
+        metrics.processing_seconds = time.perf_counter() - start
+        return self.finish_step(step, results, variables, metrics)
+
+    async def aprocess_step(
+        self, step: steps.Step, variables: dict[str, str]
+    ) -> tuple[list[str], dict[str, str]]:
+        """Like `process_step`, with file reads, generation and post-processing off the event loop."""
+        loop = asyncio.get_running_loop()
+        metrics = StepMetrics(step.title)
+        self.logger.debug("Unformatted inputs: %s", utils.Outline(step.inputs))
+        self.logger.debug("Old variables: %s", utils.Outline(variables))
+        formatted = await loop.run_in_executor(
+            None, step.format_inputs, step.inputs, variables
+        )
+        self.logger.debug("Formatted inputs: %s", utils.Outline(formatted))
+        stats = self.start_stream(step)
+        results = await self.acli.process(
+            formatted, step.template, stats, step.max_combinations, metrics
+        )
+        results = await self.acli.run(self.reduce, step, results, stats, metrics)
+        self.finish_stream(step, stats)
+        start = time.perf_counter()
+        results = await loop.run_in_executor(None, step.processing, results)
+        metrics.processing_seconds = time.perf_counter() - start
+        return self.finish_step(step, results, variables, metrics)
+
+    def reduce(
+        self,
+        step: steps.Step,
+        results: list[str],
+        stats: ai.StreamStats | None = None,
+        metrics: StepMetrics | None = None,
+    ) -> list[str]:
+        """Runs the rounds of prompts `step.reduce_inputs` asks for over `results`."""
+        reduction = step.reduce_inputs(results)
+        while reduction is not None:
+            self.logger.debug("Reducing %s responses", len(results))
+            results = self.cli.process(
+                reduction, step.template, stats, step.max_combinations, metrics
+            )
+            reduction = step.reduce_inputs(results)
+        return step.reduced_responses(results)
+
+    def start_stream(self, step: steps.Step) -> ai.StreamStats | None:
+        if not self.streaming:
+            return None
+        # Several steps may stream at once when there are several workers.
+        return ai.StreamStats(self.stream_output, step.title, self.workers == 1)
+
+    def finish_stream(self, step: steps.Step, stats: ai.StreamStats | None):
+        if stats is None:
+            return
+        summary = self.stream_stats[id(step)] = stats.finish()
+        self.logger.warning(
+            "%s: first token after %.2fs, %.2f tokens/s",
+            step.title,
+            summary["time_to_first_token"],
+            summary["tokens_per_second"],
+        )
+
+    def finish_step(
+        self,
+        step: steps.Step,
+        results: list,
+        variables: dict[str, str],
+        metrics: StepMetrics | None = None,
+    ) -> tuple[list[str], dict[str, str]]:
+        self.logger.debug("Processed results: %s", utils.Outline(results))
         new_variables = step.match_outputs(results, step.outputs, variables)
-        self.logger.debug("New variables: " + str(new_variables))
+        self.logger.debug("New variables: %s", utils.Outline(new_variables))
         results = step.flatten(["## " + step.title] + results)
+        if metrics:
+            summary = self.step_metrics[id(step)] = metrics.finish()
+            self.logger.info(
+                "%s: %.2fs, %.2fs generating, %.2fs processing, %s cached",
+                step.title,
+                summary["wall_seconds"],
+                summary["generation_seconds"],
+                summary["processing_seconds"],
+                summary["cache_hits"],
+            )
         return results, new_variables
 
-    def interpret(self) -> Report:
-        report = Report(self.prompt, text=["# " + self.prompt], category=self.name)
+    def interpret(self, checkpoint: dict | None = None) -> Report:
+        """Runs `ainterpret` to completion. Use `ainterpret` from inside an event loop."""
+        return asyncio.run(self.ainterpret(checkpoint))
+
+    async def ainterpret(self, checkpoint: dict | None = None) -> Report:
+        """
+        Runs every step and returns the report.
+
+        After each step, `self.checkpoint(state)` is called, when set, with the
+        variables, finished steps and their results, and how much of the
+        report file they fill. Passing that state back as `checkpoint` skips
+        the finished steps without calling the model.
+        """
+        heading = ["# " + self.prompt]
+        report = Report(
+            self.prompt,
+            text=[] if self.writer else list(heading),
+            category=self.name,
+            output=self.writer.path if self.writer else None,
+        )
         variables: dict[str, str] = {"prompt": self.prompt}
-        for step in self.generate_promptStep():
-            report.prompts += [step]
-            results, variables = self.process_step(step, variables)
-            report.text += step.flatten(results)
+        finished: dict[int, tuple[str, list[str]]] = {}
+        if checkpoint:
+            variables = dict(checkpoint["variables"])
+            finished = dict(checkpoint["finished"])
+            report.start = checkpoint["start"]
+            self.logger.warning("Resuming after %s finished steps.", len(finished))
+
+        def is_finished(idx: int, step: steps.Step) -> bool:
+            return idx in finished and finished[idx][0] == step.title
+
+        def on_result(idx: int, results: list[str]):
+            if self.writer:
+                self.writer.write_section(idx, results)
+            finished[idx] = (step_titles[idx], results)
+            if self.checkpoint:
+                written, offset = self.writer.position() if self.writer else (0, 0)
+                self.checkpoint(
+                    {
+                        "variables": dict(variables),
+                        "finished": dict(finished),
+                        "start": report.start,
+                        "written": written,
+                        "offset": offset,
+                    }
+                )
+
+        step_titles: dict[int, str] = {}
+        if self.writer:
+            if checkpoint:
+                self.writer.resume(checkpoint["written"], checkpoint.get("offset"))
+            else:
+                self.writer.start(heading)
+        try:
+            if self.workers > 1:
+                step_list = list(self.generate_promptStep())
+                report.prompts += step_list
+                step_titles.update(enumerate(step.title for step in step_list))
+                done = {
+                    idx: finished[idx][1]
+                    for idx, step in enumerate(step_list)
+                    if is_finished(idx, step)
+                }
+                if self.writer:
+                    for idx in sorted(done):
+                        self.writer.write_section(idx, done[idx])
+                scheduler = StepScheduler(step_list, self.workers)
+                step_results = await scheduler.run(
+                    self.aprocess_step, variables, on_result, done
+                )
+                if not self.writer:
+                    for step, results in zip(step_list, step_results):
+                        report.text += step.flatten(results)
+            else:
+                for idx, step in enumerate(self.generate_promptStep()):
+                    report.prompts += [step]
+                    step_titles[idx] = step.title
+                    if is_finished(idx, step):
+                        results = finished[idx][1]
+                        if self.writer:
+                            self.writer.write_section(idx, results)
+                    else:
+                        results, variables = await self.aprocess_step(step, variables)
+                        on_result(idx, results)
+                    if not self.writer:
+                        report.text += step.flatten(results)
+        finally:
+            if self.writer:
+                self.writer.close()
 
         report.end = datetime.now()
+        report.metrics = [self.step_metrics.get(id(step)) for step in report.prompts]
+        if self.streaming:
+            report.stream_stats = [
+                self.stream_stats.get(id(step)) for step in report.prompts
+            ]
         return report
 
+    def close(self):
+        """Hands the models back to the registry so the next task can reuse them."""
+        self.cli.close()
+        if self.cli.semantic_cache is not None:
+            self.cli.semantic_cache.close()
+            self.cli.semantic_cache = None
+
+
+async def interpret_many(generators: list[Generator], concurrency: int = 2) -> list[Report]:
+    """Awaits every generator's report, running at most `concurrency` at once."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def interpret(generator: Generator) -> Report:
+        async with semaphore:
+            return await generator.ainterpret()
+
+    return await asyncio.gather(*(interpret(generator) for generator in generators))
+
 
 class BasicGenerator(Generator):
     def generate_promptStep(self) -> steps.Step:
@@ -226,7 +447,7 @@ class AdaptiveGenerator(Generator):
             try:
                 step_type = (
                     input(
-                        "What type of step do you want? { step, liststep, codestep, filestep, exit } [step]: "
+                        "What type of step do you want? { step, liststep, codestep, filestep, chunkstep, exit } [step]: "
                     )
                     or "step"
                 )
@@ -260,5 +481,9 @@ class AdaptiveGenerator(Generator):
                     yield steps.FileStep(
                         step_title, step_inputs, step_outputs, step_template
                     )
+                elif step_type == "chunkstep":
+                    yield steps.ChunkStep(
+                        step_title, step_inputs, step_outputs, step_template
+                    )
             except KeyboardInterrupt:
                 pass
@@ -0,0 +1,240 @@
+import http.client
+import json
+import os
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Iterator
+from generate.ai import API
+from generate.cache import ResponseStore
+
+# Statuses worth trying again: the server is busy, starting up or restarting.
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+# Errors of a kept-alive connection the server closed while it sat idle.
+STALE_ERRORS = (
+    http.client.RemoteDisconnected,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+
+class BackendError(RuntimeError):
+    """A request the server refused, or kept failing until the retries ran out."""
+
+
+class ConnectionPool:
+    """
+    Keep-alive connections to one server, reused so requests skip the TCP
+    and TLS handshakes. A connection serves one request at a time; callers
+    beyond the idle ones get a new connection, and at most `size` are kept.
+
+    Arguments:
+        url: str - The server's base URL, e.g. http://127.0.0.1:8080/v1.
+        size: int - The most idle connections kept open.
+        timeout: float - Seconds to wait on the socket before giving up.
+    """
+
+    def __init__(self, url: str, size: int = 8, timeout: float = 600):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"Expected an http(s) URL, got {url!r}")
+        self.connection_class = (
+            http.client.HTTPSConnection
+            if parts.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path.rstrip("/")
+        self.size = size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.idle: list[http.client.HTTPConnection] = []
+        self.opened = 0
+
+    @contextmanager
+    def connection(self) -> Iterator[http.client.HTTPConnection]:
+        """
+        Yields an idle connection, or a new one. A connection left mid-response
+        by an error is closed, and reconnects on its next request.
+        """
+        with self.lock:
+            connection = self.idle.pop() if self.idle else None
+        if connection is None:
+            connection = self.connection_class(self.host, self.port, timeout=self.timeout)
+            with self.lock:
+                self.opened += 1
+        try:
+            yield connection
+        except BaseException:
+            connection.close()
+            raise
+        finally:
+            with self.lock:
+                if len(self.idle) < self.size:
+                    self.idle.append(connection)
+                    connection = None
+            if connection is not None:
+                connection.close()
+
+    def close(self):
+        with self.lock:
+            connections, self.idle = self.idle, []
+        for connection in connections:
+            connection.close()
+
+
+def retry_after(response: http.client.HTTPResponse) -> float | None:
+    try:
+        return float(response.getheader("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def read_events(response: http.client.HTTPResponse) -> Iterator[str]:
+    """Yields the content of each server-sent chat completion chunk."""
+    for line in response:
+        line = line.strip()
+        if not line.startswith(b"data:"):
+            continue
+        data = line[5:].strip()
+        if data == b"[DONE]":
+            break
+        delta = json.loads(data)["choices"][0].get("delta") or {}
+        if delta.get("content"):
+            yield delta["content"]
+    # Drain the rest so the connection can be reused.
+    response.read()
+
+
+class HTTPAPI(API):
+    """
+    Generates with an OpenAI-compatible chat completions server, such as
+    llama.cpp's server or vLLM, which batches requests across clients.
+
+    Requests go out `concurrency` at a time over a pool of keep-alive
+    connections. Connection errors and busy statuses are retried with
+    exponential backoff, or after the server's Retry-After. Each combination
+    is its own request, because the server keeps evaluated prompts itself.
+
+    The server, model and key default to the GENERATE_HTTP_URL,
+    GENERATE_HTTP_MODEL and GENERATE_HTTP_API_KEY environment variables.
+
+    Arguments:
+        base_url: str - The URL the /chat/completions path is added to.
+        model: str - The model name sent with each request.
+        api_key: str - Sent as a bearer token, when set.
+        concurrency: int - Requests in flight at once, or None for the class's `concurrency`.
+        timeout: float - Seconds to wait on the server before retrying.
+        retries: int - Attempts after the first before giving up.
+    """
+
+    model = "default"
+    parameters = {"max_tokens": 2048, "temperature": 0.9, "top_p": 0.9}
+    share_prefixes = False
+    concurrency: int = 8
+    backoff: float = 0.5
+    max_backoff: float = 30.0
+
+    def __init__(
+        self,
+        caching=True,
+        cache: ResponseStore = None,
+        base_url: str = None,
+        model: str = None,
+        api_key: str = None,
+        concurrency: int = None,
+        timeout: float = 600,
+        retries: int = 3,
+    ):
+        super().__init__(caching, cache)
+        self.base_url = base_url or os.environ.get(
+            "GENERATE_HTTP_URL", "http://127.0.0.1:8080/v1"
+        )
+        self.model = model or os.environ.get("GENERATE_HTTP_MODEL", self.model)
+        api_key = api_key or os.environ.get("GENERATE_HTTP_API_KEY")
+        self.concurrency = concurrency or self.concurrency
+        self.retries = retries
+        self.pool = ConnectionPool(self.base_url, self.concurrency, timeout)
+        self.headers = {"Content-Type": "application/json"}
+        if api_key:
+            self.headers["Authorization"] = f"Bearer {api_key}"
+        if self.concurrency > 1:
+            self.executor = ThreadPoolExecutor(self.concurrency)
+        self.retried = 0
+
+    def chat(self, message: str, system_template: str = "", stream: bool = False) -> Iterator[str]:
+        """
+        Posts one chat completion and yields its content, in pieces when
+        streaming. A request is retried only until its first piece arrives.
+        """
+        messages = [{"role": "user", "content": message}]
+        if system_template:
+            messages.insert(0, {"role": "system", "content": system_template})
+        body = json.dumps(
+            {"model": self.model, "messages": messages, "stream": stream, **self.parameters}
+        ).encode("utf8")
+        path = self.pool.path + "/chat/completions"
+        attempt = 0
+        while True:
+            delay = None
+            with self.pool.connection() as connection:
+                reused = connection.sock is not None
+                received = False
+                try:
+                    connection.request("POST", path, body, self.headers)
+                    response = connection.getresponse()
+                    if response.status in RETRY_STATUSES:
+                        response.read()
+                        delay = retry_after(response)
+                        error = BackendError(f"{response.status} {response.reason}")
+                    elif response.status >= 400:
+                        raise BackendError(
+                            f"{response.status} {response.reason}: {response.read()[:500]!r}"
+                        )
+                    elif stream:
+                        for token in read_events(response):
+                            received = True
+                            yield token
+                        return
+                    else:
+                        content = json.loads(response.read())["choices"][0]["message"]
+                        yield content.get("content") or ""
+                        return
+                except (OSError, http.client.HTTPException) as exception:
+                    if received:
+                        raise
+                    connection.close()
+                    if reused and isinstance(exception, STALE_ERRORS):
+                        # The server dropped an idle connection; a new one costs no backoff.
+                        continue
+                    error = exception
+            attempt += 1
+            if attempt > self.retries:
+                raise BackendError(
+                    f"Gave up on {self.base_url} after {attempt} attempts: {error}"
+                ) from error
+            self.retried += 1
+            delay = min(
+                delay if delay is not None else self.backoff * 2 ** (attempt - 1),
+                self.max_backoff,
+            )
+            self.logger.warning(
+                "Retrying %s in %.1fs after: %s", self.base_url, delay, error
+            )
+            time.sleep(delay)
+
+    # override
+    def generate(self, message: str, system_template: str = "") -> str:
+        return "".join(self.chat(message, system_template))
+
+    # override
+    def stream(self, message: str, system_template: str = "") -> Iterator[str]:
+        yield from self.chat(message, system_template, stream=True)
+
+    # override
+    def close(self):
+        super().close()
+        self.pool.close()
@@ -0,0 +1,165 @@
+import re
+
+# A backtick fence's info string can't hold backticks; a tilde fence's can.
+FENCE = r"(?P<fence>```+(?=[^`\n]*$)|~~~+)[ \t]*(?P<info>[^\n]*)"
+# Lines that can open or close a list item or a code block; anything else is prose.
+BLOCKS = re.compile(
+    r"^(?P<indent>[ \t]*)(?:"
+    + FENCE
+    + r"|(?P<header>#{1,6})(?:[ \t][^\n]*)?"
+    r"|(?P<rule>(?:[-*_][ \t]*){3,})"
+    r"|(?P<marker>[0-9]{1,9}[.)]|[A-Za-z][.)]|[-+*])(?:[ \t]+(?P<text>[^\n]*))?"
+    r")[ \t]*$",
+    re.MULTILINE,
+)
+# Starting each pattern with a literal lets the engine skip ahead to the next
+# fence; `at_line_start` rejects fences that aren't alone on their line.
+FENCES = {
+    "`": re.compile(r"(?P<fence>```+)[ \t]*(?P<info>[^`\n]*)[ \t]*$", re.MULTILINE),
+    "~": re.compile(r"(?P<fence>~~~+)[ \t]*(?P<info>[^\n]*)[ \t]*$", re.MULTILINE),
+}
+closing_fences: dict[str, re.Pattern] = {}
+
+
+class Structure:
+    """
+    The lists and fenced code blocks of one Markdown response.
+
+    Attributes:
+        items: list[str] - Top-level list items without their markers; nested items and continuation lines stay in their parent.
+        code_blocks: list[tuple[str, str]] - (info string, body) of each fenced block, in order.
+    """
+
+    def __init__(self):
+        self.items: list[str] = []
+        self.code_blocks: list[tuple[str, str]] = []
+
+
+def closing_fence(fence: str) -> re.Pattern:
+    if fence not in closing_fences:
+        closing_fences[fence] = re.compile(
+            re.escape(fence) + re.escape(fence[0]) + r"*[ \t]*$", re.MULTILINE
+        )
+    return closing_fences[fence]
+
+
+def at_line_start(text: str, start: int) -> bool:
+    """Whether only spaces and tabs come before `start` on its line."""
+    line_start = text.rfind("\n", 0, start) + 1
+    return not text[line_start:start].strip(" \t")
+
+
+def search_fence(pattern: re.Pattern, text: str, position: int) -> re.Match | None:
+    match = pattern.search(text, position)
+    while match is not None and not at_line_start(text, match.start()):
+        match = pattern.search(text, match.end())
+    return match
+
+
+class FenceSearch:
+    """Finds the next opening fence of either kind, remembering each kind's next match."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.next: dict[str, re.Match | None] = {
+            kind: None for kind in FENCES if kind * 3 in text
+        }
+
+    def search(self, position: int) -> re.Match | None:
+        found = None
+        for kind, match in self.next.items():
+            if match is None or match.start() < position:
+                match = self.next[kind] = search_fence(FENCES[kind], self.text, position)
+            if match is not None and (found is None or match.start() < found.start()):
+                found = match
+        return found
+
+
+def parse(text: str, lists: bool = True) -> Structure:
+    """
+    Finds the lists and code blocks of `text` in one forward scan.
+
+    The compiled patterns only stop at lines that matter: code bodies are
+    skipped by searching for their closing fence, and prose is only read
+    while it may continue an open list item. Numbered, lettered and bulleted
+    items are recognized, but not inside code blocks. A fence left open, as
+    in a truncated generation, runs to the end of the text.
+    Without `lists`, only code blocks are collected.
+    """
+    if "\r" in text:
+        text = text.replace("\r\n", "\n")
+    structure = Structure()
+    fences = FenceSearch(text)
+    item: list[str] | None = None
+    item_indent = 0
+    item_offset = 0
+
+    def close_item():
+        nonlocal item
+        if item is not None:
+            structure.items.append("\n".join(item).strip())
+            item = None
+
+    def continue_item(gap: str):
+        # Prose continues the open item until a blank line and an outdented line end it.
+        after_blank = False
+        for line in gap.split("\n"):
+            stripped = line.strip()
+            if not stripped:
+                after_blank = True
+                continue
+            if after_blank and len(line) - len(line.lstrip()) <= item_indent:
+                close_item()
+                return
+            item.append(stripped)
+            after_blank = False
+
+    position = 0
+    while True:
+        if lists:
+            match = BLOCKS.search(text, position)
+        else:
+            match = fences.search(position)
+        if item is not None:
+            gap = text[position : match.start() if match else len(text)]
+            if gap.strip():
+                continue_item(gap)
+        if match is None:
+            break
+        position = match.end() + 1
+        if match["fence"]:
+            close_item()
+            end = search_fence(closing_fence(match["fence"]), text, position)
+            body = text[
+                position : text.rfind("\n", 0, end.start()) + 1 if end else len(text)
+            ]
+            structure.code_blocks.append((match["info"].rstrip(), body.rstrip("\n")))
+            if end is None:
+                break
+            position = end.end() + 1
+            continue
+        if match["header"] or match["rule"]:
+            close_item()
+            continue
+        indent = len(match["indent"].expandtabs(4))
+        if item is not None and indent > item_indent:
+            # A nested item keeps its marker, indented under its parent.
+            item.append(text[match.start() + item_offset : match.end()].rstrip())
+            continue
+        close_item()
+        item = [(match["text"] or "").rstrip()]
+        item_indent = indent
+        item_offset = len(match["indent"])
+    close_item()
+    return structure
+
+
+def parse_all(texts: list[str], lists: bool = True) -> list[Structure]:
+    """Parses a step's responses as one batch; repeated responses are parsed once."""
+    parsed: dict[str, Structure] = {}
+    structures = []
+    for text in texts:
+        if text not in parsed:
+            parsed[text] = parse(text, lists)
+        structures.append(parsed[text])
+    return structures
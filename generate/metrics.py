@@ -0,0 +1,145 @@
+import json
+import os
+import threading
+import time
+
+
+class StepMetrics:
+    """
+    Where one step's time went.
+
+    `API.process` fills in the generation side and the generator the rest.
+    Token counts cover generated responses only; cached responses count as hits.
+
+    Attributes:
+        title: str - The step's title.
+        wall_seconds: float - From formatting the inputs to matching the outputs.
+        generation_seconds: float - Spent waiting on the model.
+        processing_seconds: float - Spent in the step's post-processing.
+        prompt_tokens: int - Tokens sent to the model.
+        completion_tokens: int - Tokens the model returned.
+        cache_hits: int - Prompts answered from the response cache.
+        cache_misses: int - Prompts sent to the model.
+        semantic_hits: int - Cache hits answered by a similar earlier prompt.
+        semantic_seconds: float - Spent embedding and searching for similar prompts.
+    """
+
+    def __init__(self, title: str = ""):
+        self.title = title
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.wall_seconds = 0.0
+        self.generation_seconds = 0.0
+        self.processing_seconds = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.semantic_hits = 0
+        self.semantic_seconds = 0.0
+
+    def record_cache(self, hits: int, misses: int):
+        with self.lock:
+            self.cache_hits += hits
+            self.cache_misses += misses
+
+    def record_semantic(self, hits: int, seconds: float):
+        with self.lock:
+            self.semantic_hits += hits
+            self.semantic_seconds += seconds
+
+    def record_generation(self, seconds: float, prompt_tokens: int, completion_tokens: int):
+        with self.lock:
+            self.generation_seconds += seconds
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    def finish(self) -> dict[str, float]:
+        self.wall_seconds = time.perf_counter() - self.start
+        return self.summary()
+
+    def summary(self) -> dict[str, float]:
+        return {
+            "title": self.title,
+            "wall_seconds": self.wall_seconds,
+            "generation_seconds": self.generation_seconds,
+            "processing_seconds": self.processing_seconds,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "tokens_per_second": self.completion_tokens / self.generation_seconds
+            if self.generation_seconds
+            else 0.0,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "semantic_hits": self.semantic_hits,
+            "semantic_seconds": self.semantic_seconds,
+        }
+
+
+def step_rows(report) -> list[dict]:
+    """One row per measured step of `report`, labelled with the report and the step's position."""
+    rows = []
+    for idx, summary in enumerate(getattr(report, "metrics", [])):
+        if summary is None:
+            continue
+        rows.append(
+            {
+                "report": report.title,
+                "category": report.category,
+                "step": idx,
+                **summary,
+            }
+        )
+    return rows
+
+
+def write_json_lines(report, path: str):
+    """Appends one JSON object per measured step to `path`."""
+    with open(path, "a", encoding="utf8") as file:
+        for row in step_rows(report):
+            file.write(json.dumps(row) + "\n")
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def write_prometheus(report, path: str, prefix: str = "generate_step"):
+    """
+    Writes `report`'s step metrics in the Prometheus text format, for the
+    node exporter's textfile collector. The file is replaced atomically so
+    the collector never reads half of it.
+    """
+    rows = step_rows(report)
+    lines = []
+    for name in (
+        "wall_seconds",
+        "generation_seconds",
+        "processing_seconds",
+        "prompt_tokens",
+        "completion_tokens",
+        "tokens_per_second",
+        "cache_hits",
+        "cache_misses",
+        "semantic_hits",
+        "semantic_seconds",
+    ):
+        lines.append(f"# TYPE {prefix}_{name} gauge")
+        for row in rows:
+            labels = ",".join(
+                f'{label}="{escape_label(row[label])}"'
+                for label in ("report", "category", "step", "title")
+            )
+            lines.append(f"{prefix}_{name}{{{labels}}} {row.get(name, 0)}")
+    temporary = path + ".tmp"
+    with open(temporary, "w", encoding="utf8") as file:
+        file.write("\n".join(lines) + "\n")
+    os.replace(temporary, path)
+
+
+def export(report, path: str):
+    """Writes the Prometheus format for `.prom` files and JSON lines otherwise."""
+    if path.endswith(".prom"):
+        write_prometheus(report, path)
+    else:
+        write_json_lines(report, path)
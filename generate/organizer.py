@@ -1,45 +1,76 @@
 import cmd
+import functools
+import multiprocessing
+import os
+import socket
+import time
+import uuid
 from datetime import datetime
-from generate.task import Task
+from generate.task import Task, format_row, read_jsonl
 from generate import utils
+from generate.cache import ResponseStore
+from generate.taskqueue import TaskQueue
+from generate.archive import ReportArchive
+from generate import report
+from generate import metrics
+from generate import ai
+from generate import semantic
 
 
 class Organizer(cmd.Cmd):
     prompt = "(prompt-organizer) "
     intro = "Welcome to the Prompt Organizer. Type help or ? to list commands."
     logger = utils.create_logger()
+    page_size = 50
+    lease_duration = 120
+    poll_interval = 5
 
     def __init__(self):
         super(Organizer, self).__init__()
+        self.tasks = TaskQueue()
+        self.worker = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.reports = ReportArchive()
 
     def do_tasks(self, empty: str | int = ""):
-        """Logs all tasks, then removes the tasks from the list based on the provided numbers."""
-        tasks = list(utils.manage_set("task"))
+        """Logs tasks by due date, after removing the task with the provided id. Usage: tasks [id | page N]"""
+        page = 0
         if isinstance(empty, int):
-            del tasks[empty]
+            self.tasks.remove(empty)
         elif isinstance(empty, str):
-            if empty and empty.isnumeric():
-                del tasks[int(empty.strip())]
+            words = empty.split()
+            if len(words) == 2 and words[0] == "page" and words[1].isnumeric():
+                page = int(words[1])
+            elif empty and empty.strip().isnumeric():
+                self.tasks.remove(int(empty.strip()))
         to_print = ""
-        tasks.sort(key=lambda task: task.due_date)
-        for idx, a_task in enumerate(tasks):
-            to_print += f"\n{idx}. {a_task}"
+        for row in self.tasks.page(page * self.page_size, self.page_size):
+            to_print += f"\n{format_row(row)}"
+        to_print += f"\n({len(self.tasks)} tasks, page {page})"
         self.logger.critical(to_print)
-        utils.manage_set("task", set(tasks))
 
     def do_reports(self, empty: str | int = ""):
-        """Logs all tasks, then removes the tasks from the list based on the provided numbers."""
-        reports = list(utils.manage_set("report"))
+        """Logs reports, after removing the report with the provided id. Usage: reports [id | page N | show id]"""
+        page = 0
         if isinstance(empty, int):
-            del reports[empty]
+            self.reports.remove(empty)
         elif isinstance(empty, str):
-            if empty and empty.isnumeric():
-                del reports[int(empty.strip())]
+            words = empty.split()
+            if len(words) == 2 and words[1].isnumeric() and words[0] == "show":
+                found = self.reports.get(int(words[1]))
+                if found is None:
+                    self.logger.error("No report has the id %s.", words[1])
+                else:
+                    self.logger.critical(found)
+                return
+            if len(words) == 2 and words[1].isnumeric() and words[0] == "page":
+                page = int(words[1])
+            elif empty and empty.strip().isnumeric():
+                self.reports.remove(int(empty.strip()))
         to_print = ""
-        for idx, a_report in enumerate(reports):
-            to_print += f"\n{idx}. {a_report}"
+        for row in self.reports.page(page * self.page_size, self.page_size):
+            to_print += f"\n{report.format_row(row)}"
+        to_print += f"\n({len(self.reports)} reports, page {page})"
         self.logger.critical(to_print)
-        utils.manage_set("report", set(reports))
 
     def do_create_prompt(self, args=""):
         """Create a prompt that will be added to the prompt list and sorted for the next task."""
@@ -63,42 +94,267 @@ class Organizer(cmd.Cmd):
         parser.add_argument(
             "--generator",
             default="gpt4all",
-            help="The type of generator. { 'gpt4all' }",
+            choices=sorted(ai.backends),
+            help="The backend generating the answers. 'http' uses the OpenAI-compatible server at GENERATE_HTTP_URL.",
+        )
+        parser.add_argument(
+            "--workers",
+            default=1,
+            type=int,
+            help="The number of model instances running independent steps at once.",
+        )
+        parser.add_argument(
+            "--stream",
+            action="store_true",
+            help="Print tokens as they are generated and time each step.",
+        )
+        parser.add_argument(
+            "--output",
+            default="Generated-{id}.md",
+            help="The Markdown file the report is written to, step by step, replacing any file there; {id} becomes the task's id.",
+        )
+        parser.add_argument(
+            "--metrics",
+            default=None,
+            help="A file to export step metrics to: Prometheus text for '.prom', else JSON lines.",
+        )
+        parser.add_argument(
+            "--semantic",
+            default=None,
+            type=float,
+            help="Reuse the cached answer of a prompt at least this similar (cosine, e.g. 0.95). Needs NumPy.",
+        )
+        parser.add_argument(
+            "--cache-max-entries",
+            default=None,
+            type=int,
+            help="Evict the least recently used responses past this many.",
+        )
+        parser.add_argument(
+            "--cache-max-bytes",
+            default=None,
+            type=int,
+            help="Evict the least recently used responses past this many bytes.",
+        )
+        parser.add_argument(
+            "--cache-max-age",
+            default=None,
+            type=float,
+            help="Evict responses cached more than this many seconds ago.",
         )
         if args == "":
             args = "-h"
         if isinstance(args, str) or isinstance(args, list[str]):
             args = parser.parse_args(args)
-            to_add = Task(args.prompt, args.datetime, args.enum, args.generator)
+            to_add = Task(
+                args.prompt,
+                args.datetime,
+                args.enum,
+                args.generator,
+                args.workers,
+                args.stream,
+                args.output,
+                args.metrics,
+                args.semantic,
+                args.cache_max_entries,
+                args.cache_max_bytes,
+                args.cache_max_age,
+            )
         else:
             to_add = None
         if to_add:
-            new_set = utils.manage_set("task")
-            new_set.add(to_add)
-            utils.manage_set("task", new_set)
+            self.tasks.push(to_add)
         self.do_tasks()
 
     def do_complete(self, empty=""):
-        """Mark a prompt as complete. This will add the prompt to Generated.md. Usage: complete"""
-        tasks = list(utils.manage_set("task"))
-        tasks.sort(key=lambda task: task.due_date)
-        if tasks:
-            current_task = tasks[0]
-            report = current_task.get_generator().interpret()
-            new_set = utils.manage_set("report")
-            new_set.add(report)
-            utils.manage_set("report", new_set)
-            self.logger.critical(report)
-            self.do_tasks(0)
+        """Mark a prompt as complete. This will write the report to the task's Markdown file, Generated-<id>.md by default. Usage: complete"""
+        self.complete_next()
+
+    def complete_next(self, failed: set[int] | None = None) -> bool:
+        """
+        Leases, runs and completes the next task, other than those in `failed`.
+        Returns False when none is free. A task that fails is logged, handed
+        back to the queue and added to `failed`.
+        """
+        failed = set() if failed is None else failed
+        current_task = self.tasks.lease(
+            self.worker, self.lease_duration, exclude=failed
+        )
+        if not current_task:
+            return False
+        try:
+            finished = self.run_task(current_task)
+        except Exception:
+            failed.add(current_task.id)
+            self.logger.exception("Task %s failed", current_task.id)
+            return True
+        if finished:
+            self.logger.critical(finished)
+            self.do_tasks()
+        return True
+
+    def run_task(self, current_task: Task) -> report.Report | None:
+        """
+        Runs a leased task and completes it. Returns its report, or None when
+        the lease was lost. On an error the task is handed back to the queue.
+        """
+        try:
+            with self.tasks.hold(current_task.id, self.worker, self.lease_duration):
+                generator = current_task.get_generator()
+                generator.checkpoint = functools.partial(
+                    self.tasks.save_checkpoint, current_task.id
+                )
+                try:
+                    finished = generator.interpret(
+                        self.tasks.load_checkpoint(current_task.id)
+                    )
+                finally:
+                    generator.close()
+        except BaseException:
+            self.tasks.release(current_task.id, self.worker)
+            raise
+        # Only the worker still holding the lease records the report.
+        if not self.tasks.complete(current_task.id, self.worker):
+            self.logger.error(
+                "Lost the lease on task %s; dropped its report.", current_task.id
+            )
+            return None
+        self.reports.add(finished)
+        if getattr(current_task, "metrics", None):
+            metrics.export(finished, current_task.metrics)
+        return finished
+
+    def do_import(self, line=""):
+        """Adds the tasks of a JSON lines file in one transaction, one task per line with the create_prompt option names as keys. Usage: import FILE"""
+        path = line.strip()
+        if not path:
+            self.logger.error("Usage: import FILE")
+            return
+        try:
+            self.import_tasks(path)
+        except (OSError, ValueError) as error:
+            self.logger.error("Nothing imported: %s", error)
+
+    def import_tasks(self, path: str) -> list[int]:
+        """Queues every task of a JSON lines file, or none of them when a line is invalid."""
+        ids = self.tasks.push_many(read_jsonl(path))
+        self.logger.warning(
+            "Imported %s tasks from %s (%s queued)", len(ids), path, len(self.tasks)
+        )
+        return ids
+
+    def run_batch(self) -> tuple[int, int]:
+        """
+        Completes queued tasks until none are left, logging progress and
+        throughput after each one instead of the report and the task list.
+        A task that fails is handed back to the queue and not retried in
+        this batch; a task whose lease expired mid-run is left to the worker
+        that took it over. Returns the numbers of completed and failed tasks.
+        """
+        start = time.perf_counter()
+        completed = 0
+        lost = 0
+        failed: set[int] = set()
+        tokens = 0
+        while True:
+            current_task = self.tasks.lease(
+                self.worker, self.lease_duration, exclude=failed
+            )
+            if not current_task:
+                if len(self.tasks) <= len(failed):
+                    break
+                # The rest are leased by other workers, or were just released by them.
+                time.sleep(self.poll_interval)
+                continue
+            task_start = time.perf_counter()
+            try:
+                finished = self.run_task(current_task)
+            except Exception:
+                failed.add(current_task.id)
+                self.logger.exception("Task %s failed", current_task.id)
+                continue
+            if finished is None:
+                lost += 1
+                continue
+            completed += 1
+            tokens += sum(
+                summary["completion_tokens"] for summary in finished.metrics if summary
+            )
+            elapsed = time.perf_counter() - start
+            remaining = max(len(self.tasks) - len(failed), 0)
+            rate = completed / elapsed if elapsed else 0.0
+            self.logger.warning(
+                "[%s/%s] task %s in %.1fs, %.3f tasks/s, %.0f tokens/s, %s failed, about %.0fs left",
+                completed,
+                completed + len(failed) + remaining,
+                current_task.id,
+                time.perf_counter() - task_start,
+                rate,
+                tokens / elapsed if elapsed else 0.0,
+                len(failed),
+                remaining / rate if rate else 0.0,
+            )
+        elapsed = time.perf_counter() - start
+        self.logger.warning(
+            "Batch finished: %s completed, %s failed, %s lost to other workers in %.1fs (%.3f tasks/s)",
+            completed,
+            len(failed),
+            lost,
+            elapsed,
+            completed / elapsed if elapsed else 0.0,
+        )
+        return completed, len(failed)
 
     def do_auto_complete(self, line=""):
-        """Automatically and continuously run the complete command. Usage: auto_complete"""
-        self.logger.warn("Starting automatic completion. Press Ctrl-C to stop.")
+        """Automatically and continuously run the complete command, optionally in N worker processes. Usage: auto_complete [N]"""
+        workers = int(line.strip()) if line and line.strip().isnumeric() else 1
+        self.logger.warning("Starting automatic completion. Press Ctrl-C to stop.")
+        if workers == 1:
+            try:
+                self.work()
+            except KeyboardInterrupt:
+                self.logger.warning("\nAutomatic completion stopped.")
+            return
+        processes = [
+            multiprocessing.Process(target=run_worker)
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
         try:
-            while self.current_task:
-                self.do_complete(None)
+            for process in processes:
+                process.join()
         except KeyboardInterrupt:
-            self.logger.warn("\nAutomatic completion stopped.")
+            for process in processes:
+                process.terminate()
+            self.logger.warning("\nAutomatic completion stopped.")
+
+    def work(self):
+        """
+        Completes tasks until the queue is empty, waiting on tasks leased by
+        other workers. A task that fails is not retried by this worker.
+        """
+        failed: set[int] = set()
+        while True:
+            if self.complete_next(failed):
+                continue
+            if len(self.tasks) <= len(failed):
+                break
+            time.sleep(self.poll_interval)
+
+    def do_cache(self, line=""):
+        """Logs the response cache's hit, miss and eviction counters, and the semantic cache's hit rate and lookup time. Usage: cache"""
+        store = ResponseStore()
+        stats = store.stats()
+        store.close()
+        if os.path.exists("embeddings.db"):
+            stats.update(
+                (f"semantic_{name}", value)
+                for name, value in semantic.file_stats().items()
+            )
+        self.logger.critical(
+            "\n".join(f"{name}: {value}" for name, value in stats.items())
+        )
 
     def do_exit(self, line=""):
         """Exit the Prompt Organizer. This command will terminate the program and return to the system command prompt."""
@@ -106,5 +362,14 @@ class Organizer(cmd.Cmd):
         return True
 
 
+def run_worker():
+    """The entry point of each auto_complete worker process."""
+    organizer = Organizer()
+    try:
+        organizer.work()
+    except KeyboardInterrupt:
+        pass
+
+
 if __name__ == "__main__":
     Organizer().cmdloop()
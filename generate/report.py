@@ -11,29 +11,49 @@ class Report:
         start: datetime - The start time of the report.
         end: datetime - The end time of the report.
         promptList: list[PromptStep] - A list of PromptStep objects related to the report.
-        text: list[str] - A list of text entries in the report.
+        text: list[str] - A list of text entries in the report, empty when written to `output` instead.
+        output: str - The Markdown file holding the report's text, or None when it is kept in `text`.
+        stream_stats: list[dict] - Time to first token and tokens/sec per prompt, when streamed.
+        metrics: list[dict] - Each prompt's `StepMetrics` summary, or None for steps resumed from a checkpoint.
+        id: int - The id given by the report archive, once archived.
     """
 
     def __init__(
         self,
         title: str = "",
-        start: datetime = datetime.now(),
-        end: datetime = datetime.now(),
-        prompts: list[Step] = [],
-        text: list[str] = [],
+        start: datetime | None = None,
+        end: datetime | None = None,
+        prompts: list[Step] | None = None,
+        text: list[str] | None = None,
         category: str = "",
+        output: str | None = None,
     ):
         self.title = title
-        self.start = start
-        self.end = end
-        self.prompts = prompts
-        self.text = text
+        self.start = start or datetime.now()
+        self.end = end or self.start
+        self.prompts = prompts if prompts is not None else []
+        self.text = text if text is not None else []
         self.category = category
+        self.output = output
+        self.stream_stats: list[dict[str, float] | None] = []
+        self.metrics: list[dict[str, float] | None] = []
+        self.id: int | None = None
 
     def __str__(self) -> str:
         to_return = f"Report({self.title}, datetime.timedelta={self.end - self.start}, {self.category})"
         display_steps = "\nyield ".join([str(step) for step in self.prompts])
         to_return += f"\n\nPrompts:\nyield {display_steps})"
-        display_text = "\n\n".join(self.text)
-        to_return += f"\n\nText:\n{display_text}"
+        # Reports archived before `output` existed kept all of their text.
+        output = getattr(self, "output", None)
+        if output and not self.text:
+            to_return += f"\n\nText: {output}"
+        else:
+            display_text = "\n\n".join(self.text)
+            to_return += f"\n\nText:\n{display_text}"
         return to_return
+
+
+def format_row(row: tuple[int, str, str, datetime, datetime, int]) -> str:
+    """Formats a `ReportArchive.page` row like `Report.__str__`'s first line."""
+    report_id, title, category, start, end, size = row
+    return f"{report_id}. Report({title}, datetime.timedelta={end - start}, {category}, {size} bytes)"
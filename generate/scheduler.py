@@ -0,0 +1,79 @@
+import asyncio
+from generate.steps import Step
+
+
+class StepScheduler:
+    """
+    Runs steps as soon as the steps they depend on finish.
+
+    A step depends on the last earlier step writing any of its inputs or
+    outputs, and on the earlier steps reading any of its outputs, so the
+    variables seen by each step match a one-by-one run.
+
+    Arguments:
+        steps: list[Step] - The steps in their declared order.
+        workers: int - The most steps running at once.
+    """
+
+    def __init__(self, steps: list[Step], workers: int):
+        self.steps = steps
+        self.workers = workers
+        self.dependencies = self.build_dependencies(steps)
+
+    @staticmethod
+    def build_dependencies(steps: list[Step]) -> list[set[int]]:
+        last_writer: dict[str, int] = {}
+        readers: dict[str, list[int]] = {}
+        dependencies = []
+        for idx, step in enumerate(steps):
+            reads = set(Step.flatten(step.inputs))
+            writes = set(step.outputs)
+            needed = set()
+            for name in reads | writes:
+                if name in last_writer:
+                    needed.add(last_writer[name])
+            for name in writes:
+                needed.update(readers.get(name, []))
+            dependencies.append(needed)
+            for name in reads:
+                readers.setdefault(name, []).append(idx)
+            for name in writes:
+                last_writer[name] = idx
+                readers[name] = []
+        return dependencies
+
+    async def run(
+        self,
+        process_step,
+        variables: dict[str, str],
+        on_result=None,
+        done: dict[int, list] = None,
+    ) -> list:
+        """
+        Awaits `process_step(step, variables)` for every step, at most `workers` at once.
+        Calls `on_result(idx, results)` as each step finishes.
+        Steps in `done` are not run again; their stored results are used.
+        Returns each step's results in the declared order.
+        """
+        done = done or {}
+        semaphore = asyncio.Semaphore(self.workers)
+        tasks: list[asyncio.Task] = []
+
+        async def run_step(idx: int):
+            if idx in done:
+                return done[idx]
+            await asyncio.gather(*(tasks[needed] for needed in self.dependencies[idx]))
+            async with semaphore:
+                results, _ = await process_step(self.steps[idx], variables)
+            if on_result:
+                on_result(idx, results)
+            return results
+
+        for idx in range(len(self.steps)):
+            tasks.append(asyncio.ensure_future(run_step(idx)))
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
@@ -0,0 +1,291 @@
+import sqlite3
+import threading
+import time
+from typing import TYPE_CHECKING, Callable
+from generate import utils
+from generate.cache import ResponseStore
+
+if TYPE_CHECKING:
+    import numpy
+
+logger = utils.create_logger()
+# Each model's embedder and the lock serializing its calls, as llmodel isn't thread-safe.
+embedders: dict[str, tuple[object, threading.Lock]] = {}
+embedders_lock = threading.Lock()
+
+
+def load_numpy():
+    """Imports NumPy, which only the semantic cache needs."""
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError(
+            "The semantic cache needs NumPy: pip install numpy"
+        ) from None
+    return numpy
+
+
+def gpt4all_embed(texts: list[str], model: str = "") -> list[list[float]]:
+    """
+    Embeds `texts` with GPT4All's CPU embedding model, loaded once per process.
+    An empty `model` uses Embed4All's default. Calls to one model take turns.
+    """
+    if model not in embedders:
+        with embedders_lock:
+            if model not in embedders:
+                from gpt4all import Embed4All
+
+                embedder = Embed4All(model) if model else Embed4All()
+                embedders[model] = (embedder, threading.Lock())
+    embedder, lock = embedders[model]
+    with lock:
+        return [embedder.embed(text) for text in texts]
+
+
+def read_stats(connection: sqlite3.Connection) -> dict[str, float]:
+    """
+    Lookups, hits, the hit rate and the mean lookup time per prompt over the
+    life of an embeddings file, plus how many prompts it holds.
+    """
+    counters = dict(connection.execute("SELECT name, value FROM counters").fetchall())
+    entries = connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    lookups = int(counters.get("lookups", 0))
+    hits = int(counters.get("hits", 0))
+    seconds = counters.get("lookup_seconds", 0.0)
+    return {
+        "lookups": lookups,
+        "hits": hits,
+        "hit_rate": hits / lookups if lookups else 0.0,
+        "mean_lookup_ms": 1000 * seconds / lookups if lookups else 0.0,
+        "entries": entries,
+    }
+
+
+def file_stats(filename: str = "embeddings.db") -> dict[str, float]:
+    """`read_stats` of a file, without loading its embeddings or NumPy."""
+    connection = sqlite3.connect(filename)
+    try:
+        return read_stats(connection)
+    finally:
+        connection.close()
+
+
+class VectorIndex:
+    """
+    Unit vectors in one growing NumPy matrix, searched by cosine similarity.
+
+    Rows are normalized when added, so a whole batch of queries is scored
+    with one matrix product. The matrix doubles when full instead of being
+    copied on every insert.
+
+    Arguments:
+        dimensions: int - The length of every vector.
+    """
+
+    def __init__(self, dimensions: int):
+        numpy = load_numpy()
+        self.dimensions = dimensions
+        self.vectors = numpy.zeros((16, dimensions), dtype=numpy.float32)
+        self.keys: list[str | None] = []
+
+    @staticmethod
+    def normalize(vectors) -> "numpy.ndarray":
+        numpy = load_numpy()
+        vectors = numpy.asarray(vectors, dtype=numpy.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        norms = numpy.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / numpy.maximum(norms, 1e-12)
+
+    def add(self, vectors, keys: list[str]):
+        numpy = load_numpy()
+        vectors = self.normalize(vectors)
+        needed = len(self.keys) + len(vectors)
+        if needed > len(self.vectors):
+            grown = numpy.zeros(
+                (max(needed, 2 * len(self.vectors)), self.dimensions),
+                dtype=numpy.float32,
+            )
+            grown[: len(self.keys)] = self.vectors[: len(self.keys)]
+            self.vectors = grown
+        self.vectors[len(self.keys) : needed] = vectors
+        self.keys.extend(keys)
+
+    def search(self, queries) -> list[tuple[str | None, float]]:
+        """The closest key to each query and its cosine similarity, or (None, 0.0) when empty."""
+        queries = self.normalize(queries)
+        if not self.keys:
+            return [(None, 0.0)] * len(queries)
+        scores = queries @ self.vectors[: len(self.keys)].T
+        best = scores.argmax(axis=1)
+        return [
+            (self.keys[position], float(scores[row, position]))
+            for row, position in enumerate(best)
+        ]
+
+    def remove(self, key: str):
+        """Stops `key` from matching; its row stays until the index is rebuilt."""
+        for position, found in enumerate(self.keys):
+            if found == key:
+                self.vectors[position] = 0.0
+                self.keys[position] = None
+
+    def __len__(self) -> int:
+        return len(self.keys) - self.keys.count(None)
+
+
+class SemanticCache:
+    """
+    Answers prompts that are close in meaning to one already answered.
+
+    Prompts are embedded with a local CPU model, and the embeddings kept in a
+    SQLite file next to the response store, keyed by the response's cache key.
+    A lookup returns the stored response of the most similar earlier prompt
+    when the cosine similarity reaches `threshold`. Prompts only match within
+    the same scope, the hash of the system template, model and parameters,
+    and for conversations of their shared context, so only the final question
+    is embedded and compared.
+
+    Hits, lookups and the time spent embedding and searching are counted over
+    the life of the file, like the response store's counters.
+
+    Arguments:
+        store: ResponseStore - Where the matched responses are read from.
+        threshold: float - The lowest cosine similarity that counts as the same prompt.
+        embed: Callable - Turns a list of texts into a list of vectors; GPT4All's embedding model by default.
+        filename: str - The database file of the embeddings.
+        model: str - The embedding model's name, kept apart in the file.
+    """
+
+    def __init__(
+        self,
+        store: ResponseStore,
+        threshold: float = 0.95,
+        embed: Callable[[list[str]], list] = None,
+        filename: str = "embeddings.db",
+        model: str = "",
+    ):
+        load_numpy()
+        self.store = store
+        self.threshold = threshold
+        self.embed_texts = embed or (lambda texts: gpt4all_embed(texts, model))
+        self.model = model
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.indexes: dict[str, VectorIndex] = {}
+        self.connection = sqlite3.connect(
+            filename, check_same_thread=False, isolation_level=None
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT NOT NULL, model TEXT NOT NULL, scope TEXT NOT NULL, vector BLOB NOT NULL, PRIMARY KEY (key, model))"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value REAL NOT NULL)"
+        )
+        self.load()
+
+    def load(self):
+        numpy = load_numpy()
+        rows = self.connection.execute(
+            "SELECT key, scope, vector FROM embeddings WHERE model = ?", (self.model,)
+        ).fetchall()
+        scoped: dict[str, tuple[list[str], list[bytes]]] = {}
+        for key, scope, vector in rows:
+            keys, vectors = scoped.setdefault(scope, ([], []))
+            keys.append(key)
+            vectors.append(vector)
+        for scope, (keys, vectors) in scoped.items():
+            matrix = numpy.frombuffer(b"".join(vectors), dtype=numpy.float32)
+            matrix = matrix.reshape(len(keys), -1)
+            self.index(scope, matrix.shape[1]).add(matrix, keys)
+
+    def index(self, scope: str, dimensions: int) -> VectorIndex:
+        if scope not in self.indexes:
+            self.indexes[scope] = VectorIndex(dimensions)
+        return self.indexes[scope]
+
+    def count(self, **amounts: float):
+        with self.lock:
+            self.connection.executemany(
+                "INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                amounts.items(),
+            )
+
+    def lookup(
+        self, messages: list[str], scopes: list[str]
+    ) -> tuple[list[str | None], list]:
+        """
+        Embeds `messages` as one batch and searches each scope's index once,
+        where `scopes` holds each message's scope.
+        Returns the response for each message, or None below the threshold,
+        and the embeddings, for `add` to reuse after generating the misses.
+        """
+        if not messages:
+            return [], []
+        start = time.perf_counter()
+        vectors = VectorIndex.normalize(self.embed_texts(messages))
+        positions: dict[str, list[int]] = {}
+        for position, scope in enumerate(scopes):
+            positions.setdefault(scope, []).append(position)
+        matches: list[tuple[str | None, float]] = [(None, 0.0)] * len(messages)
+        with self.lock:
+            for scope, rows in positions.items():
+                index = self.indexes.get(scope)
+                if index:
+                    for row, match in zip(rows, index.search(vectors[rows])):
+                        matches[row] = match
+        responses: list[str | None] = []
+        for (key, score), scope in zip(matches, scopes):
+            response = None
+            if key is not None and score >= self.threshold:
+                response = self.store.get(key)
+                if response is None:
+                    # The response store evicted it.
+                    self.forget(key, scope)
+            responses.append(response)
+        seconds = time.perf_counter() - start
+        hits = len(responses) - responses.count(None)
+        self.count(lookups=len(messages), hits=hits, lookup_seconds=seconds)
+        logger.info(
+            "Semantic cache: %s of %s prompts matched in %.1fms",
+            hits,
+            len(messages),
+            seconds * 1000,
+        )
+        return responses, vectors
+
+    def add(self, vectors, keys: list[str], scopes: list[str]):
+        """Indexes the embeddings of newly cached responses under their cache keys and scopes."""
+        if not keys:
+            return
+        vectors = VectorIndex.normalize(vectors)
+        with self.lock:
+            for key, vector, scope in zip(keys, vectors, scopes):
+                self.index(scope, vectors.shape[1]).add(vector, [key])
+            with self.connection:
+                self.connection.execute("BEGIN")
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, model, scope, vector) VALUES (?, ?, ?, ?)",
+                    [
+                        (key, self.model, scope, vector.tobytes())
+                        for key, vector, scope in zip(keys, vectors, scopes)
+                    ],
+                )
+
+    def forget(self, key: str, scope: str):
+        with self.lock:
+            if scope in self.indexes:
+                self.indexes[scope].remove(key)
+            self.connection.execute(
+                "DELETE FROM embeddings WHERE key = ? AND model = ?", (key, self.model)
+            )
+
+    def stats(self) -> dict[str, float]:
+        with self.lock:
+            return read_stats(self.connection)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
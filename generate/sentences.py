@@ -0,0 +1,107 @@
+import re
+import threading
+import time
+from generate import utils
+
+logger = utils.create_logger()
+nltk_lock = threading.Lock()
+nltk_ready = False
+punkt_tokenizers: dict[str, object] = {}
+# Batches at least this long log their throughput.
+report_chars = 100_000
+
+ABBREVIATIONS = "Mr Mrs Ms Dr Prof Sr Jr St vs etc e.g i.e Fig Vol".split()
+# A sentence ends at . ! or ? (and any closing quotes or brackets) followed by
+# whitespace and something that can start a sentence, unless the period ends
+# a known abbreviation or an initial.
+# The lookbehinds follow the first punctuation mark so the engine can skip
+# ahead to punctuation instead of trying them at every character.
+SENTENCE_END = re.compile(
+    r"(?P<end>[.!?]"
+    + "".join(rf"(?<!\b{re.escape(abbreviation)}\.)" for abbreviation in ABBREVIATIONS)
+    + r"(?<!\b[A-Z]\.)[.!?]*[\"')\]]*)\s+(?=[\"'(\[]?[A-Z0-9])"
+)
+
+
+def load_nltk():
+    """
+    Imports NLTK the first time a step needs it, downloading the Punkt
+    sentence models only when they are missing, so later runs stay offline.
+    """
+    global nltk_ready
+    with nltk_lock:
+        import nltk
+
+        if not nltk_ready:
+            try:
+                nltk.data.find("tokenizers/punkt")
+            except LookupError:
+                nltk.download("punkt", quiet=True)
+            nltk_ready = True
+    return nltk
+
+
+def punkt_tokenizer(language: str = "english"):
+    """Loads the Punkt model for `language` once per process."""
+    if language not in punkt_tokenizers:
+        nltk = load_nltk()
+        with nltk_lock:
+            if language not in punkt_tokenizers:
+                punkt_tokenizers[language] = nltk.data.load(
+                    f"tokenizers/punkt/{language}.pickle"
+                )
+    return punkt_tokenizers[language]
+
+
+def split_rules(text: str) -> list[str]:
+    """
+    Splits `text` on sentence punctuation with a few regular expressions.
+    Much faster than Punkt, but it only knows a handful of abbreviations.
+    """
+    sentences = []
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        sentence = text[start : match.end("end")].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+    sentence = text[start:].strip()
+    if sentence:
+        sentences.append(sentence)
+    return sentences
+
+
+def segment_all(
+    texts: list[str], splitter: str = "punkt", language: str = "english"
+) -> list[list[str]]:
+    """
+    Splits every text of a step into sentences as one batch: the tokenizer
+    is loaded once and repeated texts are split once.
+
+    Arguments:
+        splitter: str - "punkt" for NLTK's Punkt model, or "rules" for `split_rules`.
+    """
+    start = time.perf_counter()
+    if splitter == "rules":
+        split = split_rules
+    elif splitter == "punkt":
+        split = punkt_tokenizer(language).tokenize
+    else:
+        raise ValueError(f"Unknown sentence splitter: {splitter}")
+    segmented: dict[str, list[str]] = {}
+    results = []
+    for text in texts:
+        if text not in segmented:
+            segmented[text] = split(text)
+        results.append(segmented[text])
+    chars = sum(len(text) for text in segmented)
+    if chars >= report_chars:
+        seconds = time.perf_counter() - start
+        logger.info(
+            "Split %s characters into sentences with %s in %.3fs (%.0f chars/s)",
+            chars,
+            splitter,
+            seconds,
+            chars / seconds if seconds else 0.0,
+        )
+    return results
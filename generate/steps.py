@@ -1,8 +1,9 @@
-import re
-import nltk
-import os
-
-nltk.download("popular", quiet=True)
+import itertools
+from typing import Iterator
+from generate import chunking
+from generate import files
+from generate import markdown
+from generate import sentences
 
 
 class Step:
@@ -14,19 +15,25 @@ class Step:
         inputs: list[list[str] | str] (only two layers of lists)
         output: list[str]
         processing: function
+        max_combinations: int | None - Cap on prompts expanded from the inputs; None keeps the class's, and a class value of None uses the API's.
     """
 
+    max_combinations: int | None = None
+
     def __init__(
         self,
         title: str = "",
         inputs: list[str | list[str]] = [],
         outputs: list = [],
         template: str = "Respond as an expert teacher would for the material at hand. Mainly, assume your work will be integrated in a larger one, so do not use intros and conclusions, use plenty of headers (`###`) to split each topic, and (most importantly) make sure to follow the prompt's categorization if provided. If you see any code, show a variety of examples regarding that code. If you see a lesson transcript/documentation, reformat the text while correcting any transcribing errors for the purpose of studying.",
+        max_combinations: int | None = None,
     ):
         self.title = title
         self.inputs = inputs
         self.outputs = outputs
         self.template = template
+        if max_combinations is not None:
+            self.max_combinations = max_combinations
 
     def format_inputs(self, inputs: list[str], variables: dict[str, str]) -> list:
         formatted = []
@@ -51,6 +58,17 @@ class Step:
                 variables[output_str] = result_str
         return variables
 
+    def reduce_inputs(self, responses: list[str]) -> list | None:
+        """
+        Inputs for another round of prompts over `responses`, or None when the
+        responses are final. Called again on that round's responses.
+        """
+        return None
+
+    def reduced_responses(self, responses: list[str]) -> list[str]:
+        """The step's responses once `reduce_inputs` returns None for `responses`."""
+        return responses
+
     def processing(self, responses: list[str]) -> list[str | list[str]]:
         to_return = []
         for response in responses:
@@ -75,32 +93,171 @@ class Step:
 
 
 class FileStep(Step):
+    """
+    A step whose inputs may name files, replaced by their contents.
+
+    A directory or glob pattern (`docs/*.md`, `./notes/**/*.txt`) expands to
+    one alternative per file, like a list input, up to `max_files`. Contents
+    come from `files.file_cache`, so unchanged files are read once per
+    process, and each file is handed to `alternatives` as it is read.
+
+    Attributes:
+        max_files: int - The most files a directory or pattern expands to.
+    """
+
+    max_files: int = 100
+
     def format_inputs(self, inputs: list[str], variables: dict[str, str]) -> list:
         formatted = []
         for item in inputs:
             if type(item) == str:
-                item = variables.get(item, item)
-                if os.path.exists(item):
-                    with open(item, "r", encoding="utf8") as file:
-                        formatted.append(file.read())
-                else:
-                    formatted.append(item)
+                contents = files.read_input(variables.get(item, item), self.max_files)
+                formatted.append(
+                    contents if isinstance(contents, str) else self.alternatives(contents)
+                )
             elif type(item) == list:
-                subitems = []
-                for subitem in item:
-                    subitem = variables.get(subitem, subitem)
-                    if os.path.exists(subitem):
-                        with open(subitem, "r", encoding="utf8") as file:
-                            subitems.append(file.read())
-                    else:
-                        subitems.append(subitem)
-                formatted.append(subitems)
+                formatted.append(self.alternatives(self.read_each(item, variables)))
         return formatted
 
+    def read_each(self, items: list[str], variables: dict[str, str]) -> Iterator[str]:
+        for item in items:
+            contents = files.read_input(variables.get(item, item), self.max_files)
+            if isinstance(contents, str):
+                yield contents
+            else:
+                yield from contents
+
+    def alternatives(self, contents: Iterator[str]) -> list[str]:
+        """The alternatives of one input, from its texts and file contents as they are read."""
+        return list(contents)
+
     def __str__(self) -> str:
         return f"step.FileStep('{self.title}', {self.inputs}, {self.outputs}, '{self.template}')"
 
 
+class ChunkStep(FileStep):
+    """
+    Answers inputs longer than the model's context in pieces, then combines the answers.
+
+    Each input, or file it names, longer than `chunk_tokens` is split at
+    paragraph and sentence boundaries into chunks that become alternatives,
+    so they are answered in parallel and cached one by one. Chunk boundaries
+    depend on the text around them only, so editing one section regenerates
+    only its chunks. The partial answers are then combined with
+    `reduce_instruction`, a budget's worth at a time, until one answer remains
+    per input: the chunks of different files, or of one file asked different
+    questions, are never combined with each other. Partial answers too long
+    to combine within the budget are kept side by side instead.
+
+    Attributes:
+        chunk_tokens: int - The most tokens of input text in one prompt.
+        chars_per_token: int - Used to turn `chunk_tokens` into characters.
+        reduce_instruction: str - The question asked of the joined partial answers.
+        separator: str - Put between the partial answers joined into one prompt.
+        sources: list[list[int]] - Per formatted input, which text each alternative was chunked from.
+    """
+
+    chunk_tokens: int = 1500
+    chars_per_token: int = 4
+    max_combinations: int | None = 1000
+    reduce_instruction: str = "The above are partial answers, each written from one part of a longer text. Combine them into one complete answer without repeating yourself."
+    separator: str = "\n\n---\n\n"
+    sources: list[list[int]] = []
+    answers: dict[tuple, list[str]] = {}
+    pending: list[tuple] | None = None
+
+    @property
+    def chunk_chars(self) -> int:
+        return self.chunk_tokens * self.chars_per_token
+
+    # override
+    def format_inputs(self, inputs: list[str], variables: dict[str, str]) -> list:
+        self.sources = []
+        self.chunked_sources = []
+        formatted = []
+        for item in super().format_inputs(inputs, variables):
+            if isinstance(item, str):
+                chunks = chunking.chunk_text(item, self.chunk_chars)
+                formatted.append(chunks if len(chunks) > 1 else item)
+                self.sources.append([0] * len(chunks))
+            else:
+                formatted.append(item)
+                self.sources.append(self.chunked_sources.pop(0))
+        self.pending = None
+        return formatted
+
+    # override
+    def alternatives(self, contents: Iterator[str]) -> list[str]:
+        chunks, sources = [], []
+        for source, content in enumerate(contents):
+            pieces = chunking.chunk_text(content, self.chunk_chars)
+            chunks += pieces
+            sources += [source] * len(pieces)
+        self.chunked_sources.append(sources)
+        return chunks
+
+    # override
+    def reduce_inputs(self, responses: list[str]) -> list | None:
+        if self.pending is None:
+            # The API answers the combinations of the inputs' alternatives in order.
+            keys = itertools.product(*[sources for sources in self.sources if sources])
+            if not self.sources:
+                keys = itertools.repeat(())
+            self.answers = {}
+            for key, response in zip(keys, responses):
+                self.answers.setdefault(key, []).append(response)
+        else:
+            for key, response in zip(self.pending, responses):
+                self.answers[key].append(response)
+        parts: list[str] = []
+        self.pending = []
+        for key, answers in self.answers.items():
+            if len(answers) <= 1:
+                continue
+            groups = self.budget_groups(answers)
+            if groups is None:
+                self.answers[key] = [self.separator.join(answers)]
+                continue
+            self.answers[key] = []
+            parts += groups
+            self.pending += [key] * len(groups)
+        if not parts:
+            self.pending = None
+            return None
+        return [parts, self.reduce_instruction]
+
+    # override
+    def reduced_responses(self, responses: list[str]) -> list[str]:
+        return [answers[0] for answers in self.answers.values()]
+
+    def budget_groups(self, answers: list[str]) -> list[str] | None:
+        """
+        Joins `answers` into as few texts within `chunk_chars` as they fit in,
+        re-chunking any answer longer than that. None when that would not
+        leave fewer texts than answers, so another round would not converge.
+        """
+        pieces = [
+            piece
+            for answer in answers
+            for piece in chunking.chunk_text(answer, self.chunk_chars)
+        ]
+        groups: list[list[str]] = [[]]
+        size = 0
+        for piece in pieces:
+            added = len(piece) + (len(self.separator) if groups[-1] else 0)
+            if groups[-1] and size + added > self.chunk_chars:
+                groups.append([])
+                size, added = 0, len(piece)
+            groups[-1].append(piece)
+            size += added
+        if len(groups) >= len(answers):
+            return None
+        return [self.separator.join(group) for group in groups]
+
+    def __str__(self) -> str:
+        return f"step.ChunkStep('{self.title}', {self.inputs}, {self.outputs}, '{self.template}')"
+
+
 class ListStep(Step):
     def __init__(
         self,
@@ -108,32 +265,25 @@ class ListStep(Step):
         inputs: list[str | list[str]] = [],
         outputs: list = [],
         template: str = "Respond as an expert Engineer would for the material at hand. Mainly, assume your work will be integrated in a larger one, so do not use intros and conclusions, use only one header (`###`), and (most importantly) make sure to use only one list with either numbers or bullets for your entire response. Be as thorough as possible.",
+        max_combinations: int | None = None,
     ):
-        super().__init__(title, inputs, outputs, template)
+        super().__init__(title, inputs, outputs, template, max_combinations)
 
     # override
-    def processing_text(self, response: str) -> str:
-        patterns = [
-            r"[\s,#,\\]*[0-9]+\.",  # For numbered lists
-            r"[\s,#,\\]*[a-z]+\.",  # For alphabetically ordered lists
-            r"[\s,#,\\]*[+,\-,*]+",  # For bullet points lists (plus, minus, asterisk)
+    def processing(self, responses: list[str]) -> list[str | list[str]]:
+        return [
+            self.list_items(response, structure)
+            for response, structure in zip(responses, markdown.parse_all(responses))
         ]
-        pattern = ""
-        lines = response.strip().split("\n")
-        for line in lines:
-            for try_pattern in patterns:
-                if re.match(pattern, line):
-                    pattern = try_pattern
-                    break
-            if pattern:
-                break
-
-        if pattern:
-            list_items = re.split(pattern, response)
-            list_items = [item.strip() for item in list_items if item.strip()]
-            return list_items
 
-        return response
+    # override
+    def processing_text(self, response: str) -> str | list[str]:
+        return self.list_items(response, markdown.parse(response))
+
+    @staticmethod
+    def list_items(response: str, structure: markdown.Structure) -> str | list[str]:
+        """The response's list items, or the response itself when it has no list."""
+        return structure.items or response
 
     def __str__(self) -> str:
         return f"step.ListStep('{self.title}', {self.inputs}, {self.outputs}, '{self.template}')"
@@ -146,35 +296,58 @@ class CodeStep(Step):
         inputs: list[str | list[str]] = [],
         outputs: list = [],
         template: str = "Respond as an expert Software Engineer would for the material at hand. Mainly, assume your work will be integrated in a larger one, so plan out your work, do not use intros and conclusions, use a header (`###`), and (most importantly) make sure your code is following the points in the prompt and only in one place. Be as thorough as possible.",
+        max_combinations: int | None = None,
     ):
-        super().__init__(title, inputs, outputs, template)
+        super().__init__(title, inputs, outputs, template, max_combinations)
 
-    def processing_text(self, response: str) -> str:
-        code_blocks = re.findall(r"```(.*?)```", response, re.DOTALL)
-        cleaned_code_blocks = []
+    # override
+    def processing(self, responses: list[str]) -> list[str | list[str]]:
+        return [
+            self.combined_code(response, structure)
+            for response, structure in zip(
+                responses, markdown.parse_all(responses, lists=False)
+            )
+        ]
 
-        # Keep 'python' in the first block and remove it from others
-        for idx, block in enumerate(code_blocks):
-            if idx == 0:
-                cleaned_code_blocks.append(block)
-            else:
-                cleaned_code_blocks.append(block.replace("python", ""))
+    # override
+    def processing_text(self, response: str) -> str:
+        return self.combined_code(response, markdown.parse(response, lists=False))
 
-        combined_code_block = "\n".join(
-            cleaned_code_blocks
-        ).strip()  # Join all the code blocks with a newline separator
-        if combined_code_block:
-            return "```" + combined_code_block + "```"
-        else:
+    @staticmethod
+    def combined_code(response: str, structure: markdown.Structure) -> str:
+        """
+        Joins the response's code blocks into one, labelled with the first
+        block's language, or returns the response when it has no code.
+        """
+        bodies = [
+            body.strip("\n") for _, body in structure.code_blocks if body.strip()
+        ]
+        if not bodies:
             return response
+        info = structure.code_blocks[0][0]
+        return "```" + info + "\n" + "\n\n".join(bodies) + "\n```"
 
     def __str__(self) -> str:
         return f"step.CodeStep('{self.title}', {self.inputs}, {self.outputs}, '{self.template}')"
 
 
 class SentenceStep(Step):
-    def processing_text(self, response: str) -> str:
-        return nltk.tokenize.sent_tokenize(response)
+    """
+    Splits each response into sentences.
+
+    Attributes:
+        splitter: str - "punkt" for NLTK's Punkt model, or "rules" for a faster, rougher regular-expression splitter.
+    """
+
+    splitter: str = "punkt"
+
+    # override
+    def processing(self, responses: list[str]) -> list[str | list[str]]:
+        return sentences.segment_all(responses, self.splitter)
+
+    # override
+    def processing_text(self, response: str) -> list[str]:
+        return sentences.segment_all([response], self.splitter)[0]
 
     def __str__(self) -> str:
         return f"step.SentenceStep('{self.title}', {self.inputs}, {self.outputs}, '{self.template}')"
@@ -1,5 +1,5 @@
+import json
 from datetime import datetime
-from generate import enum
 
 
 class Task:
@@ -11,22 +11,179 @@ class Task:
         due_date: date - The due date for the task.
         category: str - The category or type of the task.
         pathList: list - A list of file paths related to the task.
+        workers: int - The number of model instances running steps concurrently.
+        streaming: bool - Whether to print tokens as they are generated.
+        output: str - The Markdown file the report is written to, step by step, with `{id}` replaced by the task's id, or None. An existing file is replaced.
+        metrics: str - The file step metrics are exported to, Prometheus for `.prom` and JSON lines otherwise, or None.
+        semantic_threshold: float - The cosine similarity above which a similar prompt's cached answer is reused, or None to only reuse exact matches.
+        cache_max_entries: int - The most responses the response cache keeps, or None for no limit.
+        cache_max_bytes: int - The most response bytes the response cache keeps, or None for no limit.
+        cache_max_age: float - Seconds a cached response stays valid, or None for no limit.
+        id: int - The id given by the task queue, once queued.
     """
 
     def __init__(
         self,
         prompt: str = "",
-        due_date: datetime = datetime.now(),
+        due_date: datetime | None = None,
         category: str = "BASIC",
         generator: str = "gpt4all",
+        workers: int = 1,
+        streaming: bool = False,
+        output: str | None = "Generated-{id}.md",
+        metrics: str | None = None,
+        semantic_threshold: float | None = None,
+        cache_max_entries: int | None = None,
+        cache_max_bytes: int | None = None,
+        cache_max_age: float | None = None,
     ):
+        # Imported here so listing tasks doesn't load the generators and their backends.
+        from generate import enum
+
         self.prompt = prompt
-        self.due_date = due_date
+        self.due_date = due_date or datetime.now()
         self.category = enum.from_string(category)
         self.generator = generator
+        self.workers = workers
+        self.streaming = streaming
+        self.output = output
+        self.metrics = metrics
+        self.semantic_threshold = semantic_threshold
+        self.cache_max_entries = cache_max_entries
+        self.cache_max_bytes = cache_max_bytes
+        self.cache_max_age = cache_max_age
+        self.id: int | None = None
 
     def get_generator(self):
-        return self.category.value(self.prompt, self.category.name, self.generator)
+        # Tasks pickled before these options existed fall back to the defaults.
+        return self.category.value(
+            self.prompt,
+            self.category.name,
+            self.generator,
+            getattr(self, "workers", 1),
+            getattr(self, "streaming", False),
+            self.output_path(),
+            getattr(self, "semantic_threshold", None),
+            {
+                "max_entries": getattr(self, "cache_max_entries", None),
+                "max_bytes": getattr(self, "cache_max_bytes", None),
+                "max_age": getattr(self, "cache_max_age", None),
+            },
+        )
+
+    def output_path(self) -> str | None:
+        """The task's Markdown file; one per task by default, so concurrent tasks never share one."""
+        output = getattr(self, "output", "Generated.md")
+        if output is None:
+            return None
+        return output.replace("{id}", str(self.id))
 
     def __str__(self) -> str:
         return f"Task({self.prompt}, {self.due_date}, {self.category.name}, {self.generator})"
+
+
+def format_row(row: tuple[int, datetime, str, str, str]) -> str:
+    """Formats a `TaskQueue.page` row like `Task.__str__`."""
+    task_id, due_date, prompt, category, generator = row
+    return f"{task_id}. Task({prompt}, {due_date}, {category}, {generator})"
+
+
+# The JSON keys of an imported task, named like the create_prompt options.
+RECORD_KEYS = {
+    "prompt": "prompt",
+    "datetime": "due_date",
+    "enum": "category",
+    "generator": "generator",
+    "workers": "workers",
+    "stream": "streaming",
+    "output": "output",
+    "metrics": "metrics",
+    "semantic": "semantic_threshold",
+    "cache_max_entries": "cache_max_entries",
+    "cache_max_bytes": "cache_max_bytes",
+    "cache_max_age": "cache_max_age",
+}
+# The JSON types each key accepts, besides null for the keys not in REQUIRED_VALUES.
+RECORD_TYPES = {
+    "prompt": str,
+    "datetime": str,
+    "enum": str,
+    "generator": str,
+    "workers": int,
+    "stream": bool,
+    "output": str,
+    "metrics": str,
+    "semantic": (int, float),
+    "cache_max_entries": int,
+    "cache_max_bytes": int,
+    "cache_max_age": (int, float),
+}
+REQUIRED_VALUES = {"prompt", "enum", "generator", "workers", "stream"}
+
+
+def check_type(key: str, value) -> bool:
+    if value is None:
+        return key not in REQUIRED_VALUES
+    # JSON true and false are not numbers.
+    if isinstance(value, bool) and RECORD_TYPES[key] is not bool:
+        return False
+    return isinstance(value, RECORD_TYPES[key])
+
+
+def from_record(record: dict) -> Task:
+    """
+    Builds a task from a JSON object with the create_prompt option names as
+    keys. Only "prompt" is required; "datetime" is in ISO format.
+    """
+    if not isinstance(record, dict):
+        raise ValueError("expected a JSON object")
+    unknown = set(record) - set(RECORD_KEYS)
+    if unknown:
+        raise ValueError(f"unknown keys {sorted(unknown)}")
+    if not isinstance(record.get("prompt"), str) or not record["prompt"]:
+        raise ValueError("'prompt' must be a non-empty string")
+    for key, value in record.items():
+        if not check_type(key, value):
+            expected = RECORD_TYPES[key]
+            names = [
+                kind.__name__
+                for kind in (expected if isinstance(expected, tuple) else (expected,))
+            ]
+            raise ValueError(
+                f"{key!r} must be {' or '.join(names)}, not {type(value).__name__}"
+            )
+    if record.get("workers", 1) < 1:
+        raise ValueError("'workers' must be at least 1")
+    options = {RECORD_KEYS[key]: value for key, value in record.items()}
+    if options.get("due_date") is not None:
+        options["due_date"] = datetime.fromisoformat(options["due_date"])
+    try:
+        task = Task(**options)
+    except KeyError as error:
+        raise ValueError(f"unknown enum {error}") from None
+    # Task has imported the generators, and with them the backends.
+    from generate import ai
+
+    if task.generator not in ai.backends:
+        raise ValueError(
+            f"unknown generator {task.generator!r}, expected one of {sorted(ai.backends)}"
+        )
+    return task
+
+
+def read_jsonl(path: str) -> list[Task]:
+    """
+    Reads one task per line of a JSON lines file, skipping blank lines.
+    Every line is checked before any task is returned, so a bad line fails
+    the whole file; the ValueError names the line.
+    """
+    tasks = []
+    with open(path, encoding="utf8") as file:
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                tasks.append(from_record(json.loads(line)))
+            except (ValueError, TypeError) as error:
+                raise ValueError(f"{path}, line {number}: {error}") from None
+    return tasks
@@ -0,0 +1,255 @@
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from generate import utils
+
+
+class TaskQueue:
+    """
+    A durable queue of tasks ordered by due date, backed by SQLite.
+
+    Tasks get a stable id when pushed. Push and pop walk the (due_date, id)
+    index, and listing reads only the summary columns, never the pickled task.
+
+    Workers in other processes share the file by leasing tasks: a leased task
+    is hidden from other workers until it is completed, released, or its lease
+    expires because its worker stopped renewing it.
+
+    Arguments:
+        filename: str - The database file.
+        legacy_filename: str - The pickle store migrated once on first use.
+    """
+
+    preview_length = 120
+
+    def __init__(self, filename: str = "tasks.db", legacy_filename: str = "main"):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            filename, check_same_thread=False, isolation_level=None
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS tasks (id INTEGER PRIMARY KEY AUTOINCREMENT, due_date REAL NOT NULL, prompt TEXT NOT NULL, category TEXT NOT NULL, generator TEXT NOT NULL, body BLOB NOT NULL, lease_owner TEXT, lease_expires REAL)"
+        )
+        columns = [
+            row[1] for row in self.connection.execute("PRAGMA table_info(tasks)")
+        ]
+        if "lease_owner" not in columns:
+            self.connection.execute("ALTER TABLE tasks ADD COLUMN lease_owner TEXT")
+            self.connection.execute("ALTER TABLE tasks ADD COLUMN lease_expires REAL")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS tasks_due_date ON tasks (due_date, id)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints (task_id INTEGER PRIMARY KEY, state BLOB NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)"
+        )
+        self.migrate(legacy_filename)
+
+    def migrate(self, legacy_filename: str = "main"):
+        """Moves the `task` set out of the pickle store, once."""
+        with self.lock:
+            if self.connection.execute(
+                "SELECT 1 FROM meta WHERE name = 'migrated'"
+            ).fetchone():
+                return
+            legacy = utils.manage_object(
+                "task", set(), stripped_filename=legacy_filename
+            )
+            with self.connection:
+                self.connection.execute("BEGIN")
+                for task in sorted(legacy, key=lambda task: task.due_date):
+                    self.insert(task)
+                self.connection.execute(
+                    "INSERT INTO meta (name, value) VALUES ('migrated', ?)",
+                    (str(len(legacy)),),
+                )
+        if legacy:
+            utils.discard_object("task", stripped_filename=legacy_filename)
+
+    def insert(self, task) -> int:
+        """Assumes the lock is held."""
+        cursor = self.connection.execute(
+            "INSERT INTO tasks (due_date, prompt, category, generator, body) VALUES (?, ?, ?, ?, ?)",
+            (
+                task.due_date.timestamp(),
+                task.prompt,
+                task.category.name,
+                task.generator,
+                b"",
+            ),
+        )
+        task.id = cursor.lastrowid
+        self.connection.execute(
+            "UPDATE tasks SET body = ? WHERE id = ?", (pickle.dumps(task), task.id)
+        )
+        return task.id
+
+    def push(self, task) -> int:
+        """Adds a task and returns its id."""
+        with self.lock:
+            with self.connection:
+                self.connection.execute("BEGIN")
+                return self.insert(task)
+
+    def push_many(self, tasks) -> list[int]:
+        """Adds tasks in one transaction, so a failed import adds none of them."""
+        with self.lock:
+            with self.connection:
+                self.connection.execute("BEGIN")
+                return [self.insert(task) for task in tasks]
+
+    def peek(self):
+        """Returns the task due first, or None."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT body FROM tasks ORDER BY due_date, id LIMIT 1"
+            ).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def pop(self):
+        """Removes and returns the task due first that nobody holds, or None."""
+        with self.lock:
+            with self.connection:
+                self.connection.execute("BEGIN IMMEDIATE")
+                row = self.connection.execute(
+                    "SELECT id, body FROM tasks WHERE lease_expires IS NULL OR lease_expires < ? ORDER BY due_date, id LIMIT 1",
+                    (time.time(),),
+                ).fetchone()
+                if row:
+                    self.connection.execute("DELETE FROM tasks WHERE id = ?", (row[0],))
+        return pickle.loads(row[1]) if row else None
+
+    def lease(self, owner: str, duration: float = 60, exclude=()):
+        """Leases the first task due that nobody holds and isn't in `exclude`, or returns None."""
+        now = time.time()
+        exclude = list(exclude)
+        skip = f" AND id NOT IN ({', '.join('?' * len(exclude))})" if exclude else ""
+        with self.lock:
+            with self.connection:
+                self.connection.execute("BEGIN IMMEDIATE")
+                row = self.connection.execute(
+                    "SELECT id, body FROM tasks WHERE (lease_expires IS NULL OR lease_expires < ?)"
+                    + skip
+                    + " ORDER BY due_date, id LIMIT 1",
+                    (now, *exclude),
+                ).fetchone()
+                if row:
+                    self.connection.execute(
+                        "UPDATE tasks SET lease_owner = ?, lease_expires = ? WHERE id = ?",
+                        (owner, now + duration, row[0]),
+                    )
+        return pickle.loads(row[1]) if row else None
+
+    def renew(self, task_id: int, owner: str, duration: float = 60) -> bool:
+        """Extends a lease; False means the lease expired and was taken."""
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE tasks SET lease_expires = ? WHERE id = ? AND lease_owner = ?",
+                (time.time() + duration, task_id, owner),
+            )
+        return cursor.rowcount > 0
+
+    def release(self, task_id: int, owner: str) -> bool:
+        """Hands a leased task back to the queue without completing it."""
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE tasks SET lease_owner = NULL, lease_expires = NULL WHERE id = ? AND lease_owner = ?",
+                (task_id, owner),
+            )
+        return cursor.rowcount > 0
+
+    def complete(self, task_id: int, owner: str) -> bool:
+        """Removes a leased task; False means the lease was lost and someone else owns it."""
+        with self.lock:
+            with self.connection:
+                self.connection.execute("BEGIN")
+                cursor = self.connection.execute(
+                    "DELETE FROM tasks WHERE id = ? AND lease_owner = ?",
+                    (task_id, owner),
+                )
+                if cursor.rowcount:
+                    self.connection.execute(
+                        "DELETE FROM checkpoints WHERE task_id = ?", (task_id,)
+                    )
+        return cursor.rowcount > 0
+
+    def save_checkpoint(self, task_id: int, state: dict):
+        """Keeps a generator's progress so a later run can resume the task."""
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO checkpoints (task_id, state) VALUES (?, ?)",
+                (task_id, pickle.dumps(state)),
+            )
+
+    def load_checkpoint(self, task_id: int) -> dict | None:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT state FROM checkpoints WHERE task_id = ?", (task_id,)
+            ).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    @contextmanager
+    def hold(self, task_id: int, owner: str, duration: float = 60):
+        """Renews a lease in the background while the block runs."""
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(duration / 3):
+                if not self.renew(task_id, owner, duration):
+                    break
+
+        renewer = threading.Thread(target=renew, daemon=True)
+        renewer.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            renewer.join()
+
+    def get(self, task_id: int):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT body FROM tasks WHERE id = ?", (task_id,)
+            ).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def remove(self, task_id: int) -> bool:
+        with self.lock:
+            with self.connection:
+                self.connection.execute("BEGIN")
+                cursor = self.connection.execute(
+                    "DELETE FROM tasks WHERE id = ?", (task_id,)
+                )
+                self.connection.execute(
+                    "DELETE FROM checkpoints WHERE task_id = ?", (task_id,)
+                )
+        return cursor.rowcount > 0
+
+    def page(
+        self, offset: int = 0, limit: int = 50
+    ) -> list[tuple[int, datetime, str, str, str]]:
+        """Returns (id, due_date, prompt, category, generator) rows in due order, prompts shortened."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id, due_date, substr(prompt, 1, ?), category, generator FROM tasks ORDER BY due_date, id LIMIT ? OFFSET ?",
+                (self.preview_length, limit, offset),
+            ).fetchall()
+        return [
+            (task_id, datetime.fromtimestamp(due_date), prompt, category, generator)
+            for task_id, due_date, prompt, category, generator in rows
+        ]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
@@ -1,8 +1,14 @@
+import atexit
+import collections
 import logging
+import logging.handlers
 import os
 import pickle
 import argparse
+import queue
+import reprlib
 import shlex
+import threading
 
 
 def manage_object(
@@ -24,12 +30,32 @@ def manage_object(
     else:
         item_dict = {main_dict: default_object}
     if new_object:
-        with open(stripped_filename + ".pkl", "wb") as file:
-            item_dict[main_dict] = new_object
-            pickle.dump(item_dict, file)
+        item_dict[main_dict] = new_object
+        dump_objects(item_dict, stripped_filename)
         return new_object
     return item_dict.get(main_dict, default_object)
 
+
+def dump_objects(item_dict: dict, stripped_filename: str = "main"):
+    """Writes to a temporary file first so a crash never leaves a partial pickle."""
+    temporary_filename = stripped_filename + ".pkl.tmp"
+    with open(temporary_filename, "wb") as file:
+        pickle.dump(item_dict, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_filename, stripped_filename + ".pkl")
+
+
+def discard_object(main_dict: str, stripped_filename: str = "main"):
+    """Removes one entry from the pickle store, if present."""
+    stripped_filename = stripped_filename.replace(".pkl", "")
+    if not os.path.exists(stripped_filename + ".pkl"):
+        return
+    with open(stripped_filename + ".pkl", "rb") as file:
+        item_dict = pickle.load(file)
+    if item_dict.pop(main_dict.replace(".pkl", ""), None) is not None:
+        dump_objects(item_dict, stripped_filename)
+
 # TODO: Support adding objects individually for convenience.
 def manage_list(name: str, new_list: list = None) -> list:
     return manage_object(name, list(), new_list)
@@ -43,47 +69,282 @@ def manage_dict(name: str, new_dict: dict = None) -> dict:
     return manage_object(name, dict(), new_dict)
 
 
-def create_logger(name="generator.log", logfile=True, filter=False):
+log_writers: dict[str, "LogWriter"] = {}
+
+
+class LogWriter:
     """
-    Usage:
-        >>> logger = create_logger()
+    Writes queued records to `handlers` on a background thread.
+
+    Records are taken in batches every `interval` seconds and the handlers
+    are flushed once per batch, so a busy caller never trades the
+    interpreter lock with the writer record by record.
+
+    Arguments:
+        log_queue: queue.Queue - Where records arrive.
+        handlers: list[logging.Handler] - Where records go, each honoring its level.
+        interval: float - Seconds between batches.
+    """
+
+    def __init__(
+        self,
+        log_queue: queue.Queue,
+        handlers: list[logging.Handler],
+        interval: float = 0.05,
+    ):
+        self.queue = log_queue
+        self.handlers = handlers
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    def start(self):
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            stopping = self.stopping.wait(self.interval)
+            self.write_pending()
+            if stopping:
+                break
+
+    def write_pending(self):
+        written = False
+        while True:
+            try:
+                record = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+            written = True
+        if written:
+            for handler in self.handlers:
+                handler.flush()
+
+    def stop(self):
+        """Writes out every queued record and stops the thread."""
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+
+
+class TruncatingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a `LogWriter` thread, so callers never wait on the log file.
+
+    Records below WARNING are diagnostics, so their arguments are rendered
+    with bounded `reprlib` output and the message is cut at `max_length`;
+    warnings and reports are kept whole. When the queue is full, diagnostics
+    are dropped and counted instead of blocking the caller.
+
+    Arguments:
+        log_queue: queue.Queue - The queue read by the `LogWriter`.
+        max_length: int - The longest diagnostic message kept, in characters.
+    """
+
+    def __init__(self, log_queue: queue.Queue, max_length: int = 2000):
+        super().__init__(log_queue)
+        self.max_length = max_length
+        self.dropped = 0
+        self.repr = reprlib.Repr()
+        self.repr.maxstring = max_length
+        self.repr.maxother = max_length
+        self.repr.maxlist = self.repr.maxdict = self.repr.maxset = 20
+
+    def shorten(self, value):
+        if isinstance(value, (int, float)):
+            return value
+        if isinstance(value, str):
+            text = value
+        else:
+            text = self.repr.repr(value)
+        if len(text) > self.max_length:
+            return f"{text[: self.max_length]}... [{len(text) - self.max_length} more characters]"
+        return text
+
+    # override
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # This handler is added last, so the record is changed in place.
+        if record.levelno < logging.WARNING:
+            msg = str(record.msg)
+            if record.args:
+                args = record.args
+                # `logger.debug("%s", mapping)` arrives as the mapping itself.
+                if isinstance(args, dict) and "%(" not in msg:
+                    args = (args,)
+                if isinstance(args, dict):
+                    msg = msg % {key: self.shorten(value) for key, value in args.items()}
+                else:
+                    msg = msg % tuple(self.shorten(arg) for arg in args)
+            record.msg = self.shorten(msg)
+        else:
+            record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    # override
+    def enqueue(self, record: logging.LogRecord):
+        if record.levelno >= logging.WARNING:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class Outline:
+    """
+    Describes step inputs and results by their sizes for debug logs: long
+    strings become a short preview and their length, nested lists their item
+    count, and dicts their keys. Nothing is rendered unless the record is.
+
+        >>> logger.debug("Inputs: %s", Outline(inputs))
     """
-    logged_messages = set()
-
-    def filter_messages(record):
-        nonlocal logged_messages
-        msg = record.getMessage()
-        if msg in logged_messages:
-            return False
-        logged_messages.add(msg)
+
+    preview_length = 40
+    max_items = 10
+
+    def __init__(self, value):
+        self.value = value
+
+    @classmethod
+    def describe(cls, value, depth: int = 0) -> str:
+        if isinstance(value, str):
+            if len(value) <= cls.preview_length:
+                return repr(value)
+            return f"{value[: cls.preview_length]!r}... ({len(value)} characters)"
+        if isinstance(value, dict):
+            keys = ", ".join(str(key) for key in list(value)[: cls.max_items])
+            return f"{{{len(value)} keys: {keys}}}"
+        if isinstance(value, (list, tuple)):
+            if depth:
+                return f"[{len(value)} items]"
+            shown = [cls.describe(item, depth + 1) for item in value[: cls.max_items]]
+            if len(value) > cls.max_items:
+                shown.append(f"... {len(value) - cls.max_items} more")
+            return "[" + ", ".join(shown) + "]"
+        return reprlib.repr(value)
+
+    def __str__(self) -> str:
+        return self.describe(self.value)
+
+    __repr__ = __str__
+
+
+class DedupeFilter(logging.Filter):
+    """
+    Drops messages seen among the last `window` distinct ones.
+    Only their hashes are kept.
+    """
+
+    def __init__(self, window: int = 1024):
+        super().__init__()
+        self.window = window
+        self.seen: collections.OrderedDict[int, None] = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    # override
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = hash(record.getMessage())
+        with self.lock:
+            if key in self.seen:
+                self.seen.move_to_end(key)
+                return False
+            self.seen[key] = None
+            if len(self.seen) > self.window:
+                self.seen.popitem(last=False)
         return True
 
+
+def create_logger(
+    name="generator.log",
+    logfile=True,
+    filter=False,
+    level: str = None,
+    max_length: int = 2000,
+    queue_size: int = 10000,
+):
+    """
+    The console gets WARNING and above, written right away so it stays in
+    order with interactive prompts. The log file gets `level` and above, by
+    default the GENERATE_LOG_LEVEL environment variable or INFO, and is
+    written on a background thread. Set GENERATE_LOG_LEVEL=DEBUG for the
+    full trace of every step. An unknown level falls back to INFO, with a
+    warning.
+
+    Usage:
+        >>> logger = create_logger()
+        >>> logger.debug("Variables: %s", variables)  # Formatted only when DEBUG is on.
+    """
     name = name.replace(".log", "")
     logger = logging.getLogger(name)
 
     if not logger.handlers:
-        logger.setLevel(logging.DEBUG)
         formatter = logging.Formatter(
             "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
             datefmt="%m/%d/%Y %I:%M:%S %p",
         )
 
-        if logfile:
-            file_handler = logging.FileHandler(name + ".log")
-            file_handler.setLevel(logging.DEBUG)
-            file_handler.setFormatter(formatter)
-            logger.addHandler(file_handler)
-
         stream_handler = logging.StreamHandler()
-        stream_handler.setLevel(logging.WARN)
+        stream_handler.setLevel(logging.WARNING)
         stream_handler.setFormatter(formatter)
         if filter:
-            stream_handler.addFilter(filter_messages)
+            stream_handler.addFilter(DedupeFilter())
         logger.addHandler(stream_handler)
 
+        unknown_level = None
+        if logfile:
+            file_handler = logging.FileHandler(name + ".log", delay=True)
+            level = level or os.environ.get("GENERATE_LOG_LEVEL", "INFO")
+            # getLevelName maps known names to numbers and anything else to a string.
+            number = logging.getLevelName(level.upper())
+            if not isinstance(number, int):
+                unknown_level, number = level, logging.INFO
+            file_handler.setLevel(number)
+            file_handler.setFormatter(formatter)
+            queue_handler = TruncatingQueueHandler(queue.Queue(queue_size), max_length)
+            queue_handler.setLevel(file_handler.level)
+            logger.addHandler(queue_handler)
+            writer = LogWriter(queue_handler.queue, [file_handler])
+            writer.start()
+            log_writers[name] = writer
+
+            def restart_in_child():
+                # A forked worker inherits the queue but not the writer thread.
+                queue_handler.queue = queue.Queue(queue_size)
+                writer.queue = queue_handler.queue
+                writer.stopping = threading.Event()
+                writer.thread = None
+                writer.start()
+
+            os.register_at_fork(after_in_child=restart_in_child)
+
+        # Calls below every handler's level return before building a record.
+        logger.setLevel(min(handler.level for handler in logger.handlers))
+        if unknown_level is not None:
+            logger.warning("Unknown log level %r; logging INFO and above.", unknown_level)
+
     return logger
 
 
+def stop_loggers():
+    """Writes out every queued record. Runs at exit."""
+    for writer in log_writers.values():
+        writer.stop()
+
+
+atexit.register(stop_loggers)
+
+
 class CustomArgumentParser(argparse.ArgumentParser):
     def exit(self, status=0, message=None):
         if status != 0:
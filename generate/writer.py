@@ -0,0 +1,75 @@
+import os
+import threading
+
+
+class MarkdownWriter:
+    """
+    Writes a report to its own Markdown file section by section.
+
+    Sections are written in their declared order even when steps finish out
+    of order, and the file is synced after each one, so a crash loses at most
+    the steps still running. `position` is the section count and byte offset
+    a checkpoint should record; resuming from it cuts off whatever was written
+    after, so a section written twice or torn by a crash never stays.
+
+    Arguments:
+        path: str - The report's Markdown file, replaced when a report starts.
+    """
+
+    def __init__(self, path: str = "Generated.md"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+        self.next_section = 0
+        self.offset = 0
+        self.pending: dict[int, list[str]] = {}
+
+    def start(self, lines: list[str]):
+        """
+        Opens the file and writes the report's heading. Whatever the file
+        held is replaced, such as what a failed run of the task left behind.
+        """
+        self.file = open(self.path, "wb")
+        self.next_section = 0
+        self.offset = 0
+        self.pending = {}
+        self.append(lines)
+
+    def resume(self, written: int, offset: int | None = None):
+        """
+        Reopens the file of an interrupted report that held `written` sections
+        in its first `offset` bytes, and drops anything after them. Checkpoints
+        saved before offsets were recorded pass None and keep the whole file.
+        """
+        self.file = open(self.path, "ab")
+        if offset is not None and self.file.tell() > offset:
+            self.file.truncate(offset)
+        self.next_section = written
+        self.offset = self.file.tell()
+        self.pending = {}
+
+    def position(self) -> tuple[int, int]:
+        """The sections written so far and the byte offset they end at."""
+        with self.lock:
+            return self.next_section, self.offset
+
+    def write_section(self, idx: int, lines: list[str]):
+        """Writes section `idx` once every earlier section has been written."""
+        with self.lock:
+            if idx < self.next_section:
+                return
+            self.pending[idx] = lines
+            while self.next_section in self.pending:
+                self.append(self.pending.pop(self.next_section))
+                self.next_section += 1
+
+    def append(self, lines: list[str]):
+        self.file.write(("\n\n".join(lines) + "\n\n").encode("utf8"))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.offset = self.file.tell()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
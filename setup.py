@@ -22,9 +22,12 @@ def main():
             "nltk==3.8.1",
             "gpt4all==2.1.0",
         ],
+        extras_require={
+            "semantic": ["numpy"],
+        },
         entry_points={
             "console_scripts": [
-                "generate=generator.__main__:main",
+                "generate=generate.__main__:main",
             ]
         },
     )
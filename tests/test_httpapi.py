@@ -0,0 +1,182 @@
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from generate import ai
+from generate.httpapi import BackendError, HTTPAPI
+
+
+def answer(message: str) -> str:
+    return f"An answer to {message}, long enough to arrive in several pieces."
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    A local chat completions server. The first `failures` requests get
+    `status`, and with `drop_idle` every connection is closed after one
+    response without telling the client, as servers do to idle connections.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, failures: int = 0, status: int = 503, drop_idle: bool = False):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.failures = failures
+        self.status = status
+        self.drop_idle = drop_idle
+        self.connections = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status: int, body: bytes, content_type: str = "application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if status != 200:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(body)
+        self.close_connection = self.server.drop_idle
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.lock:
+            self.server.requests += 1
+            failing = self.server.failures > 0
+            self.server.failures -= failing
+        if failing:
+            self.reply(self.server.status, b"{}")
+            return
+        content = answer(request["messages"][-1]["content"])
+        if not request.get("stream"):
+            choice = {"message": {"role": "assistant", "content": content}}
+            self.reply(200, json.dumps({"choices": [choice]}).encode("utf8"))
+            return
+        events = [
+            {"choices": [{"delta": {"content": content[start : start + 8]}}]}
+            for start in range(0, len(content), 8)
+        ]
+        body = "".join(f"data: {json.dumps(event)}\n\n" for event in events)
+        self.reply(200, (body + "data: [DONE]\n\n").encode("utf8"), "text/event-stream")
+
+
+@pytest.fixture(autouse=True)
+def quiet_logger(monkeypatch):
+    # The package's log file path is fixed at import, so retry warnings would land in the working tree.
+    monkeypatch.setattr(logging.getLogger("generator"), "disabled", True)
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(**options) -> StandInServer:
+        servers.append(StandInServer(**options))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def connect(server: StandInServer, **options) -> HTTPAPI:
+    api = HTTPAPI(caching=False, base_url=server.url, **options)
+    api.backoff = 0.0
+    return api
+
+
+def test_generate_reuses_the_connection(serve):
+    server = serve()
+    api = connect(server, concurrency=1)
+    assert [api.generate(f"q{idx}") for idx in range(3)] == [
+        answer(f"q{idx}") for idx in range(3)
+    ]
+    api.close()
+    assert server.connections == 1
+
+
+def test_stream_yields_server_sent_events(serve):
+    server = serve()
+    api = connect(server)
+    pieces = list(api.stream("coffee"))
+    api.close()
+    assert len(pieces) > 1
+    assert "".join(pieces) == answer("coffee")
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_busy_statuses_are_retried(serve, status):
+    server = serve(failures=2, status=status)
+    api = connect(server)
+    assert api.generate("coffee") == answer("coffee")
+    api.close()
+    assert api.retried == 2
+    assert server.requests == 3
+
+
+def test_retries_run_out(serve):
+    server = serve(failures=10)
+    api = connect(server, retries=2)
+    with pytest.raises(BackendError):
+        api.generate("coffee")
+    api.close()
+    assert server.requests == 3
+
+
+def test_client_errors_are_not_retried(serve):
+    server = serve(failures=1, status=400)
+    api = connect(server)
+    with pytest.raises(BackendError):
+        api.generate("coffee")
+    api.close()
+    assert server.requests == 1
+
+
+def test_stale_connections_reconnect_without_retrying(serve):
+    server = serve(drop_idle=True)
+    api = connect(server, concurrency=1)
+    assert api.generate("q1") == answer("q1")
+    assert "".join(api.stream("q2")) == answer("q2")
+    api.close()
+    assert api.retried == 0
+    assert server.connections == 2
+
+
+def test_process_runs_every_combination(serve):
+    server = serve(failures=1)
+    api = connect(server, concurrency=4)
+    questions = [f"q{idx}" for idx in range(8)]
+    responses = api.process(["context", questions])
+    api.close()
+    assert len(responses) == 8 and all(responses)
+    assert server.connections <= 4 + 1
+
+
+@pytest.mark.parametrize("workers, concurrency", [(3, 3), (1, 1), (None, 8)])
+def test_backend_concurrency_follows_workers(workers, concurrency, tmp_path, monkeypatch):
+    # The registry's backend caches responses in the working directory.
+    monkeypatch.chdir(tmp_path)
+    api = ai.create_backend("http", workers)
+    api.close()
+    assert api.concurrency == concurrency